@@ -0,0 +1,197 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from main import edit_distance, encode, hamming_distance, random_dna
+
+_CODES = np.full(256, 255, dtype=np.uint8)
+for _i, _c in enumerate("ACGT"):
+    _CODES[ord(_c)] = _i
+
+_HAMMING_CHUNK = 64  # words compared before dropping pairs over max_dist
+_BYTE_CELLS = 1 << 22  # symbols compared at once without 2-bit packing
+
+_worker_data = None
+
+
+def pack_2bit(seqs):
+    # every symbol takes 2 bits, 32 symbols per uint64 word, tail zero-padded
+    codes = np.stack([_CODES[encode(s)] for s in seqs])
+    assert (codes != 255).all(), "2-bit packing supports only ACGT"
+    n, length = codes.shape
+    n_words = (length + 31) // 32
+    padded = np.zeros((n, n_words * 32), dtype=np.uint64)
+    padded[:, :length] = codes
+    shifts = np.arange(32, dtype=np.uint64) * np.uint64(2)
+    words = padded.reshape(n, n_words, 32) << shifts
+    return np.bitwise_or.reduce(words, axis=2)
+
+
+def hamming_rows(seqs):
+    # 2-bit packed rows when every symbol is ACGT, the uint8 symbols else
+    codes = np.stack([encode(s) for s in seqs])
+    if (_CODES[codes] != 255).all():
+        return pack_2bit(codes)
+    return codes
+
+
+def byte_hamming(x, ys, max_dist=None):
+    # distances from uint8 row x to every row of ys over the symbols of
+    # _HAMMING_CHUNK packed words at a time, in blocks of rows; rows over
+    # max_dist drop out after every step, as in packed_hamming
+    step = _HAMMING_CHUNK * 32
+    block = max(1, _BYTE_CELLS // step)
+    res = np.zeros(len(ys), dtype=np.int64)
+    active = np.arange(len(ys))
+    for start in range(0, len(x), step):
+        cols = slice(start, start + step)
+        for lo in range(0, len(active), block):
+            rows = active[lo : lo + block]
+            res[rows] += (ys[rows, cols] != x[cols]).sum(-1)
+        if max_dist is not None:
+            active = active[res[active] <= max_dist]
+            if len(active) == 0:
+                break
+    if max_dist is not None:
+        np.minimum(res, max_dist + 1, out=res)
+    return res
+
+
+def popcount(x):
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(x).sum(axis=-1, dtype=np.int64)
+    table = np.array([bin(i).count("1") for i in range(256)], dtype=np.int64)
+    return table[x.view(np.uint8)].sum(axis=-1)
+
+
+def packed_hamming(x, ys, max_dist=None):
+    # distances from packed row x to every packed row of ys
+    low_bits = np.uint64(0x5555555555555555)
+    res = np.zeros(len(ys), dtype=np.int64)
+    active = np.arange(len(ys))
+    for start in range(0, x.shape[-1], _HAMMING_CHUNK):
+        chunk = slice(start, start + _HAMMING_CHUNK)
+        z = x[chunk] ^ ys[active, chunk]
+        res[active] += popcount((z | (z >> np.uint64(1))) & low_bits)
+        if max_dist is not None:
+            active = active[res[active] <= max_dist]
+            if len(active) == 0:
+                break
+    if max_dist is not None:
+        np.minimum(res, max_dist + 1, out=res)
+    return res
+
+
+def pairs_before(i, n):  # condensed index of the pair (i, i + 1)
+    return n * i - i * (i + 1) // 2
+
+
+def row_tiles(n, n_tiles):
+    # split rows so that every tile holds about the same number of pairs
+    total = pairs_before(n, n)
+    bounds = [0]
+    for i in range(n):
+        if pairs_before(i + 1, n) * n_tiles >= total * len(bounds):
+            bounds.append(i + 1)
+    return [(a, b) for a, b in zip(bounds, bounds[1:]) if a < b]
+
+
+def _init_worker(data):
+    global _worker_data
+    _worker_data = data
+
+
+def _tile(metric, lo, hi, max_dist):
+    data = _worker_data
+    n = len(data)
+    res = []
+    for i in range(lo, hi):
+        if metric == "hamming" and data.dtype == np.uint8:
+            res.append(byte_hamming(data[i], data[i + 1 :], max_dist))
+        elif metric == "hamming":
+            res.append(packed_hamming(data[i], data[i + 1 :], max_dist))
+        else:
+            res.append(
+                [
+                    edit_distance(data[i], data[j], max_dist)
+                    for j in range(i + 1, n)
+                ]
+            )
+    return lo, np.concatenate(res).astype(np.int32)
+
+
+def distance_matrix(
+    seqs, metric="levenshtein", max_dist=None, square=False, n_jobs=1
+):
+    # condensed (i < j, row-major, as scipy's pdist) or square matrix,
+    # tiles of rows computed in n_jobs processes when n_jobs > 1; every
+    # pair stops early once over max_dist and is reported as max_dist + 1
+    assert metric in ("hamming", "levenshtein")
+    n = len(seqs)
+    if metric == "hamming":
+        assert len(set(map(len, seqs))) <= 1
+        data = hamming_rows(seqs) if n else seqs
+    else:
+        data = [str(s) for s in seqs]
+
+    tiles = row_tiles(n, 4 * n_jobs)
+    condensed = np.zeros(pairs_before(n, n), dtype=np.int32)
+
+    def store(lo, values):
+        start = pairs_before(lo, n)
+        condensed[start : start + len(values)] = values
+
+    if n_jobs == 1:
+        _init_worker(data)
+        for lo, hi in tiles:
+            store(*_tile(metric, lo, hi, max_dist))
+    else:
+        with ProcessPoolExecutor(
+            n_jobs, initializer=_init_worker, initargs=(data,)
+        ) as pool:
+            futures = [
+                pool.submit(_tile, metric, lo, hi, max_dist)
+                for lo, hi in tiles
+            ]
+            for future in futures:
+                store(*future.result())
+
+    if not square:
+        return condensed
+    res = np.zeros((n, n), dtype=np.int32)
+    rows, cols = np.triu_indices(n, 1)
+    res[rows, cols] = res[cols, rows] = condensed
+    return res
+
+
+def test(seqs, max_dist=None, n_jobs=1):
+    n = len(seqs)
+    lev = distance_matrix(seqs, max_dist=max_dist, square=True, n_jobs=n_jobs)
+    length = min(map(len, seqs))
+    prefixes = [s[:length] for s in seqs]
+    ham = distance_matrix(
+        prefixes, "hamming", max_dist, square=True, n_jobs=n_jobs
+    )
+    cap = np.inf if max_dist is None else max_dist + 1
+    for i in range(n):
+        for j in range(n):
+            true_lev = edit_distance(seqs[i], seqs[j])
+            true_ham = hamming_distance(prefixes[i], prefixes[j])
+            assert lev[i, j] == min(true_lev, cap)
+            assert ham[i, j] == min(true_ham, cap)
+
+
+def main():
+    seqs = [random_dna(length) for length in range(1, 150, 7)]
+    test(seqs, n_jobs=1)
+    test(seqs, max_dist=40)
+    test([random_dna(3000) for _ in range(8)], max_dist=2000, n_jobs=2)
+    test(["ACGN", "ACGT", "acgt", "NNNN"])
+    noisy = ["N" + random_dna(3000 + i) for i in range(6)]
+    test(noisy, max_dist=1000)
+    test(noisy, max_dist=2300, n_jobs=2)
+    print("random tests passed")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,11 @@
 import glob
 import random
 
-from Bio import SeqIO
+import numpy as np
 from distance import levenshtein, hamming
 
+from fasta import MappedFasta
+
 
 def hamming_distance(s, t):
     assert len(s) == len(t)
@@ -30,6 +32,63 @@ def hamming_search(s, t):  # search s in t
     return ibest, t[ibest : ibest + n], dbest
 
 
+def encode(s):
+    if isinstance(s, np.ndarray):
+        return s
+    return np.frombuffer(str(s).encode(), dtype=np.uint8)
+
+
+def mismatch_counts_window(s_codes, t_codes, block=1 << 20):
+    n = len(s_codes)
+    windows = np.lib.stride_tricks.sliding_window_view(t_codes, n)
+    step = max(1, block // n)
+    res = np.empty(len(windows), dtype=np.int64)
+    for i in range(0, len(windows), step):
+        res[i : i + step] = (windows[i : i + step] != s_codes).sum(axis=1)
+    return res
+
+
+def mismatch_counts_fft(s_codes, t_codes):
+    # matches at offset i for symbol c is the cross-correlation of the
+    # indicator arrays [s == c] and [t == c], summed over shared symbols
+    n, m = len(s_codes), len(t_codes)
+    size = 1 << (n + m - 1).bit_length()
+    spectrum = np.zeros(size // 2 + 1, dtype=np.complex128)
+    for c in np.intersect1d(s_codes, t_codes):
+        a = (s_codes[::-1] == c).astype(np.float64)
+        b = (t_codes == c).astype(np.float64)
+        spectrum += np.fft.rfft(a, size) * np.fft.rfft(b, size)
+    matches = np.rint(np.fft.irfft(spectrum, size)[n - 1 : m])
+    return n - matches.astype(np.int64)
+
+
+def mismatch_counts(s, t):  # hamming distance of s to every window of t
+    s_codes, t_codes = encode(s), encode(t)
+    assert len(s_codes) <= len(t_codes)
+    if len(s_codes) <= 32:
+        return mismatch_counts_window(s_codes, t_codes)
+    return mismatch_counts_fft(s_codes, t_codes)
+
+
+def hamming_search_fast(s, t):
+    n = len(s)
+    dists = mismatch_counts(s, t)
+    ibest = int(dists.argmin())
+    return ibest, t[ibest : ibest + n], int(dists[ibest])
+
+
+def hamming_search_all(s, t, max_dist=None, top_k=None):
+    # offsets (sorted by distance, then position) within max_dist of s,
+    # at most top_k of them
+    dists = mismatch_counts(s, t)
+    if max_dist is None:
+        idxs = np.arange(len(dists))
+    else:
+        idxs = np.flatnonzero(dists <= max_dist)
+    idxs = idxs[np.lexsort((idxs, dists[idxs]))][:top_k]
+    return idxs, dists[idxs]
+
+
 def levenshtein_distance(s, t):
     n, m = len(s), len(t)
     if n > m:
@@ -51,12 +110,80 @@ def levenshtein_distance(s, t):
     return dp[k][n]
 
 
+def match_masks(s):
+    peq = dict()
+    for i, c in enumerate(s):
+        peq[c] = peq.get(c, 0) | (1 << i)
+    return peq
+
+
+def myers_distance(s, t, max_dist=None):
+    # Myers / Hyyro bit-vector algorithm: bit i of the vertical delta
+    # vectors pv / mv holds the +1 / -1 difference between rows i and i + 1
+    # of the current DP column, so the whole column is updated in O(1)
+    # word operations (a Python int is used as an arbitrary-width word);
+    # with max_dist set, returns max_dist + 1 as soon as it is exceeded
+    n, m = len(s), len(t)
+    if n > m:
+        s, t = t, s
+        n, m = m, n
+    if max_dist is not None and m - n > max_dist:
+        return max_dist + 1
+    if n == 0:
+        return m
+    peq = match_masks(s)
+    mask = (1 << n) - 1
+    high = 1 << (n - 1)
+    pv, mv = mask, 0
+    res = n
+    for k, c in enumerate(t, 1):
+        eq = peq.get(c, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | (~(xh | pv) & mask)
+        mh = pv & xh
+        if ph & high:
+            res += 1
+        elif mh & high:
+            res -= 1
+        ph = ((ph << 1) | 1) & mask
+        mh = (mh << 1) & mask
+        pv = mh | (~(xv | ph) & mask)
+        mv = ph & xv
+        # the last row can drop by at most one per remaining column
+        if max_dist is not None and res - (m - k) > max_dist:
+            return max_dist + 1
+    return res
+
+
+def edit_distance(s, t, max_dist=None):
+    if min(len(s), len(t)) < 2:
+        res = levenshtein_distance(s, t)
+        return res if max_dist is None else min(res, max_dist + 1)
+    return myers_distance(s, t, max_dist)
+
+
 def test(s, t, verbose=True):
     n = min(len(s), len(t))
     hdist = hamming_distance(s[:n], t[:n])
     assert hdist == hamming(s[:n], t[:n])
     levdist = levenshtein_distance(s, t)
     assert levdist == levenshtein(s, t)
+    assert levdist == myers_distance(s, t) == edit_distance(s, t)
+    assert min(levdist, 11) == edit_distance(s, t, max_dist=10)
+    if 0 < len(s) <= len(t):
+        assert hamming_search(s, t) == hamming_search_fast(s, t)
+        assert list(mismatch_counts(s, t)) == [
+            hamming_distance(s, t[i : i + len(s)])
+            for i in range(len(t) - len(s) + 1)
+        ]
+        dists = mismatch_counts(s, t)
+        order = sorted(range(len(dists)), key=lambda i: (dists[i], i))
+        top_k = len(order) // 3 + 1
+        assert list(hamming_search_all(s, t, top_k=top_k)[0]) == order[:top_k]
+        max_dist = int(np.median(dists))
+        expected = [i for i in order if dists[i] <= max_dist]
+        assert list(hamming_search_all(s, t, max_dist)[0]) == expected
     if verbose:
         print("hamming_distance:", hdist)
         print("hamming_search:", *hamming_search(s, t))
@@ -79,9 +206,8 @@ def main():
 
     # seq tests
     for fname in glob.glob("data/*.fasta"):
-        seqs = []
-        for record in SeqIO.parse(fname, "fasta"):
-            seqs.append(record.seq)
+        fasta = MappedFasta(fname)
+        seqs = [fasta.string(i) for i in range(len(fasta))]
         print(fname)
         test(*seqs, verbose=True)
 
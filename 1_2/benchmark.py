@@ -0,0 +1,44 @@
+import time
+
+import Bio.Align.substitution_matrices as substitution_matrices
+
+from main import affine_gap_alignment, needleman_wunsch, random_dna
+
+
+def cells_per_second(fn, s, t, *args, **kwargs):
+    start = time.perf_counter()
+    fn(s, t, *args, **kwargs)
+    elapsed = time.perf_counter() - start
+    return len(s) * len(t) / elapsed
+
+
+def report(name, fn, s, t, *args):
+    loop = cells_per_second(fn, s, t, *args)
+    wavefront = cells_per_second(fn, s, t, *args, wavefront=True)
+    print(
+        f"{name} {len(s)}x{len(t)}:",
+        f"loop {loop:.3e} cells/s,",
+        f"wavefront {wavefront:.3e} cells/s,",
+        f"speedup {wavefront / loop:.1f}x",
+    )
+
+
+def main():
+    cost_matrix = substitution_matrices.load("BLOSUM62")
+    for length in (200, 500, 1000):
+        s = random_dna(length)
+        t = random_dna(length)
+        report("needleman_wunsch", needleman_wunsch, s, t, cost_matrix, -2)
+        report(
+            "affine_gap_alignment",
+            affine_gap_alignment,
+            s,
+            t,
+            cost_matrix,
+            -2,
+            -1,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -5,10 +5,54 @@ import numpy as np
 from Bio import SeqIO
 from Bio.pairwise2 import align, affine_penalty
 
+from encoding import encode
+
 _BLANK = "-"
 
 
-def needleman_wunsch(s, t, cost_matrix, gap_cost=-1):
+def dense_matrix(cost_matrix):
+    # (alphabet, scores) where scores[i, j] is the cost of (alphabet[i],
+    # alphabet[j]); Bio substitution matrices are already dense arrays
+    alphabet = getattr(cost_matrix, "alphabet", None)
+    if isinstance(alphabet, str):
+        return alphabet, np.asarray(cost_matrix, dtype=np.float64)
+    alphabet = "".join(sorted(set(c for pair in cost_matrix for c in pair)))
+    scores = np.array(
+        [[cost_matrix[(a, b)] for b in alphabet] for a in alphabet],
+        dtype=np.float64,
+    )
+    return alphabet, scores
+
+
+def load_matrix(name):
+    return dense_matrix(substitution_matrices.load(name))
+
+
+def prepare(s, t, cost_matrix):
+    # cost_matrix may be a mapping or an (alphabet, scores) pair from
+    # dense_matrix; s and t may be strings or EncodedSeq
+    if isinstance(cost_matrix, tuple):
+        alphabet, scores = cost_matrix
+    else:
+        alphabet, scores = dense_matrix(cost_matrix)
+    return encode(s, alphabet), encode(t, alphabet), scores
+
+
+def anti_diagonals(n, m):
+    # cell (i, j) lives at i * (m + 1) + j in the flattened matrix, so
+    # the inner cells of the anti-diagonal i + j = d form a slice with step m
+    if n == 0 or m == 0:
+        return
+    for d in range(2, n + m + 1):
+        lo, hi = max(1, d - m), min(n, d - 1)
+        yield d, lo, hi, slice(lo * m + d, hi * m + d + 1, m)
+
+
+def shift(sl, offset):
+    return slice(sl.start - offset, sl.stop - offset, sl.step)
+
+
+def needleman_wunsch_fill(s, t, scores, gap_cost=-1):
     n, m = len(s), len(t)
 
     res = np.zeros((n + 1, m + 1))
@@ -16,12 +60,48 @@ def needleman_wunsch(s, t, cost_matrix, gap_cost=-1):
     res[0, ...] = np.arange(m + 1) * gap_cost
 
     for i in range(n):
+        row = scores[s.codes[i]][t.codes].tolist()
         for j in range(m):
             res[i + 1, j + 1] = max(
-                res[i][j] + cost_matrix[(s[i], t[j])],
+                res[i][j] + row[j],
                 res[i + 1][j] + gap_cost,
                 res[i][j + 1] + gap_cost,
             )
+    return res
+
+
+def needleman_wunsch_fill_wavefront(s, t, scores, gap_cost=-1):
+    n, m = len(s), len(t)
+    s_codes, t_rev = s.codes, t.codes[::-1]
+
+    res = np.zeros((n + 1, m + 1))
+    res[..., 0] = np.arange(n + 1) * gap_cost
+    res[0, ...] = np.arange(m + 1) * gap_cost
+
+    flat = res.reshape(-1)
+    for d, lo, hi, cur in anti_diagonals(n, m):
+        score = scores[
+            s_codes[lo - 1 : hi], t_rev[m - d + lo : m - d + hi + 1]
+        ]
+        flat[cur] = np.maximum(
+            np.maximum(
+                flat[shift(cur, m + 2)] + score,
+                flat[shift(cur, 1)] + gap_cost,
+            ),
+            flat[shift(cur, m + 1)] + gap_cost,
+        )
+    return res
+
+
+def needleman_wunsch(s, t, cost_matrix, gap_cost=-1, wavefront=False):
+    s, t, scores = prepare(s, t, cost_matrix)
+    n, m = len(s), len(t)
+
+    if wavefront:
+        res = needleman_wunsch_fill_wavefront(s, t, scores, gap_cost)
+    else:
+        res = needleman_wunsch_fill(s, t, scores, gap_cost)
+
     s_ans, t_ans = [], []
     i, j = n - 1, m - 1
     while i >= 0 and j >= 0:
@@ -33,7 +113,7 @@ def needleman_wunsch(s, t, cost_matrix, gap_cost=-1):
             t_ans.append(t[j])
             s_ans.append(_BLANK)
             j -= 1
-        if res[i + 1, j + 1] == res[i, j] + cost_matrix[(s[i], t[j])]:
+        if res[i + 1, j + 1] == res[i, j] + scores[s.codes[i], t.codes[j]]:
             s_ans.append(s[i])
             t_ans.append(t[j])
             i -= 1
@@ -50,9 +130,8 @@ def needleman_wunsch(s, t, cost_matrix, gap_cost=-1):
     return res[n][m], "".join(reversed(s_ans)), "".join(reversed(t_ans))
 
 
-def affine_gap_alignment(s, t, cost_matrix, alpha, beta):
+def affine_gap_init(n, m, alpha, beta):
     INF = 1e9
-    n, m = len(s), len(t)
 
     resM = np.zeros((n + 1, m + 1))
     resA = resM.copy()
@@ -66,8 +145,15 @@ def affine_gap_alignment(s, t, cost_matrix, alpha, beta):
 
     resM[1:, 0] = -INF
     resM[0, 1:] = -INF
+    return resM, resA, resB
+
+
+def affine_gap_fill(s, t, scores, alpha, beta):
+    n, m = len(s), len(t)
+    resM, resA, resB = affine_gap_init(n, m, alpha, beta)
 
     for i in range(n):
+        row = scores[s.codes[i]][t.codes].tolist()
         for j in range(m):
             resA[i + 1, j + 1] = max(
                 resM[i + 1, j] + alpha + beta,
@@ -79,9 +165,46 @@ def affine_gap_alignment(s, t, cost_matrix, alpha, beta):
                 resA[i, j + 1] + alpha + beta,
                 resB[i, j + 1] + beta,
             )
-            resM[i + 1, j + 1] = cost_matrix[(s[i], t[j])] + max(
+            resM[i + 1, j + 1] = row[j] + max(
                 resM[i, j], resA[i, j], resB[i, j]
             )
+    return resM, resA, resB
+
+
+def affine_gap_fill_wavefront(s, t, scores, alpha, beta):
+    n, m = len(s), len(t)
+    s_codes, t_rev = s.codes, t.codes[::-1]
+    resM, resA, resB = affine_gap_init(n, m, alpha, beta)
+
+    flatM, flatA, flatB = (mat.reshape(-1) for mat in (resM, resA, resB))
+    for d, lo, hi, cur in anti_diagonals(n, m):
+        left, up, diag = shift(cur, 1), shift(cur, m + 1), shift(cur, m + 2)
+        flatA[cur] = np.maximum(
+            np.maximum(flatM[left] + alpha + beta, flatA[left] + beta),
+            flatB[left] + alpha + beta,
+        )
+        flatB[cur] = np.maximum(
+            np.maximum(flatM[up] + alpha + beta, flatA[up] + alpha + beta),
+            flatB[up] + beta,
+        )
+        score = scores[
+            s_codes[lo - 1 : hi], t_rev[m - d + lo : m - d + hi + 1]
+        ]
+        flatM[cur] = score + np.maximum(
+            np.maximum(flatM[diag], flatA[diag]), flatB[diag]
+        )
+    return resM, resA, resB
+
+
+def affine_gap_alignment(s, t, cost_matrix, alpha, beta, wavefront=False):
+    s, t, scores = prepare(s, t, cost_matrix)
+    n, m = len(s), len(t)
+
+    if wavefront:
+        fill = affine_gap_fill_wavefront
+    else:
+        fill = affine_gap_fill
+    resM, resA, resB = fill(s, t, scores, alpha, beta)
 
     ans = max(resM[n, m], resA[n, m], resB[n, m])
     if ans == resM[n, m]:
@@ -167,15 +290,31 @@ def affine_alignment_score(a, b, cost_matrix, alpha, beta):
     return score
 
 
-def test_needleman_wunsch(s, t, cost_matrix, gap_cost=-1):
+def test_needleman_wunsch(s, t, cost_matrix, gap_cost=-1, dense=None):
     score, *alignments = needleman_wunsch(s, t, cost_matrix, gap_cost)
+    assert (score, *alignments) == needleman_wunsch(
+        s, t, cost_matrix, gap_cost, wavefront=True
+    )
+    if dense is not None:
+        s_enc, t_enc = encode(s, dense[0]), encode(t, dense[0])
+        assert (score, *alignments) == needleman_wunsch(
+            s_enc, t_enc, dense, gap_cost
+        )
     true_score = align.globalds(s, t, cost_matrix, gap_cost, gap_cost)[0].score
     assert score == true_score
     assert true_score == alignment_score(*alignments, cost_matrix, gap_cost)
 
 
-def test_affine_gap(s, t, cost_matrix, alpha, beta):
+def test_affine_gap(s, t, cost_matrix, alpha, beta, dense=None):
     score, *alignments = affine_gap_alignment(s, t, cost_matrix, alpha, beta)
+    assert (score, *alignments) == affine_gap_alignment(
+        s, t, cost_matrix, alpha, beta, wavefront=True
+    )
+    if dense is not None:
+        s_enc, t_enc = encode(s, dense[0]), encode(t, dense[0])
+        assert (score, *alignments) == affine_gap_alignment(
+            s_enc, t_enc, dense, alpha, beta, wavefront=True
+        )
     test_score = affine_alignment_score(*alignments, cost_matrix, alpha, beta)
     assert score == test_score
     gap_fn = affine_penalty(alpha + beta, beta, False)
@@ -193,6 +332,7 @@ def main():
     gap_costs = [-1, -2]
 
     cost_matrix = substitution_matrices.load("BLOSUM62")
+    dense = load_matrix("BLOSUM62")
 
     # seq tests
     for fname in ("../1_1/data/gattaca.fasta", "../1_1/data/GATTACA2.fasta"):
@@ -202,9 +342,9 @@ def main():
         print(fname, end=" ")
         for alpha in alphas:
             for beta in betas:
-                test_affine_gap(*seqs, cost_matrix, alpha, beta)
+                test_affine_gap(*seqs, cost_matrix, alpha, beta, dense)
         for gap_cost in gap_costs:
-            test_needleman_wunsch(*seqs, cost_matrix, gap_cost)
+            test_needleman_wunsch(*seqs, cost_matrix, gap_cost, dense)
         print("passed")
 
     # rand tests
@@ -216,9 +356,9 @@ def main():
         t = random_dna(random.randrange(max_len - 1) + 1)
         for alpha in alphas:
             for beta in betas:
-                test_affine_gap(s, t, cost_matrix, alpha, beta)
+                test_affine_gap(s, t, cost_matrix, alpha, beta, dense)
         for gap_cost in gap_costs:
-            test_needleman_wunsch(s, t, cost_matrix, gap_cost)
+            test_needleman_wunsch(s, t, cost_matrix, gap_cost, dense)
     print("random tests passed")
 
 
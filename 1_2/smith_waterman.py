@@ -0,0 +1,196 @@
+import random
+
+import Bio.Align.substitution_matrices as substitution_matrices
+import numpy as np
+from Bio.pairwise2 import align
+
+from main import affine_alignment_score, affine_gap_alignment, prepare
+
+_LANES = 8
+
+
+class QueryProfile:
+    # scores of every query position against every alphabet symbol, in
+    # Farrar's striped order: query position i sits in segment i % seg of
+    # lane i // seg, so position i - 1 is the previous segment of the same
+    # lane, except for segment 0 whose predecessor ends the previous lane;
+    # the extra last symbol pads the targets of a batch and scores -inf
+    def __init__(self, query, alphabet, scores, lanes=_LANES):
+        n = len(query)
+        self.query = query
+        self.alphabet = alphabet
+        self.lanes = lanes
+        self.seg = max(1, -(-n // lanes))
+        flat = np.full((len(alphabet) + 1, self.seg * lanes), -np.inf)
+        flat[:-1, :n] = scores[query.codes].T
+        self.striped = np.ascontiguousarray(
+            flat.reshape(-1, lanes, self.seg).transpose(0, 2, 1)
+        )
+        position = np.arange(self.seg * lanes).reshape(lanes, self.seg).T
+        self.position = position.reshape(-1)  # query index of a flat cell
+        self.real = position < n
+
+
+def striped_column(h, e, profile, alpha, beta, steps):
+    # one target column for a batch of (batch, seg, lanes) striped vectors
+    diag = np.empty_like(h)
+    diag[:, 1:] = h[:, :-1]
+    diag[:, 0, 1:] = h[:, -1, :-1]
+    diag[:, 0, 0] = 0
+    diag += profile
+    e = np.maximum(e + beta, h + alpha + beta)
+    x = np.maximum(np.maximum(diag, e), 0)
+
+    # vertical gaps inside a lane are a running max over segments
+    f = np.full_like(x, -np.inf)
+    f[:, 1:] = np.maximum.accumulate(x - steps, axis=1)[:, :-1]
+    f[:, 1:] += steps[1:] + alpha
+    h = np.maximum(x, f)
+
+    # lazy F: carry gaps over lane boundaries until nothing improves
+    carry = np.full(h.shape[::2], -np.inf)
+    for _ in range(h.shape[2] - 1):
+        carry[:, 1:] = np.maximum(
+            f[:, -1, :-1] + beta, h[:, -1, :-1] + alpha + beta
+        )
+        cand = carry[:, None, :] + (steps - steps[0])
+        if not (cand > f).any():
+            break
+        np.maximum(f, cand, out=f)
+        np.maximum(h, f, out=h)
+    return h, e
+
+
+def striped_scan(profile, targets, alpha, beta):
+    # best local score of the query against every target and the cell
+    # (query end, target end) where it is reached
+    batch = len(targets)
+    length = max(map(len, targets), default=0)
+    pad = len(profile.alphabet)
+    codes = np.full((batch, length), pad, dtype=np.intp)
+    for b, target in enumerate(targets):
+        codes[b, : len(target)] = target.codes
+
+    shape = (batch, profile.seg, profile.lanes)
+    h = np.zeros(shape)
+    e = np.full(shape, -np.inf)
+    steps = (np.arange(profile.seg) * beta)[:, None]
+    best = np.zeros(batch)
+    ends = np.full((batch, 2), -1)
+    real = profile.real.astype(np.float64)
+    for j in range(length):
+        h, e = striped_column(
+            h, e, profile.striped[codes[:, j]], alpha, beta, steps
+        )
+        flat = (h * real).reshape(batch, -1)
+        idx = flat.argmax(axis=1)
+        cur = flat[np.arange(batch), idx]
+        better = cur > best
+        best[better] = cur[better]
+        ends[better, 0] = profile.position[idx[better]]
+        ends[better, 1] = j
+    return best, ends
+
+
+def anchored_start(s, t, scores, alpha, beta, best):
+    # s and t are reversed prefixes ending at the local optimum; the first
+    # cell of the start-anchored (free end) DP reaching best is where the
+    # optimal local alignment starts
+    n = len(s)
+    steps = np.arange(n + 1) * beta
+    h = alpha + steps.astype(np.float64)
+    h[0] = 0
+    e = np.full(n + 1, -np.inf)
+    profile = scores[s.codes].T
+    for j in range(len(t)):
+        e[1:] = np.maximum(e[1:] + beta, h[1:] + alpha + beta)
+        x = np.empty(n + 1)
+        x[0] = alpha + beta * (j + 1)
+        x[1:] = np.maximum(h[:-1] + profile[t.codes[j]], e[1:])
+        h = np.maximum.accumulate(x - steps)
+        h[1:] = np.maximum(x[1:], h[:-1] + alpha + steps[1:])
+        hits = np.flatnonzero(h[1:] == best)
+        if len(hits):
+            return hits[0], j
+    raise AssertionError("local optimum is not reachable")
+
+
+def smith_waterman(s, t, cost_matrix, alpha, beta, traceback=False):
+    # local alignment of query s in target t with affine gaps (a gap of
+    # length k costs alpha + k * beta); returns the score, and with
+    # traceback also the start offsets and the aligned substrings
+    s, t, scores = prepare(s, t, cost_matrix)
+    profile = QueryProfile(s, s.alphabet, scores)
+    best, ends = striped_scan(profile, [t], alpha, beta)
+    score = best[0]
+    if not traceback:
+        return score
+    if score <= 0:
+        return score, 0, 0, "", ""
+
+    s_end, t_end = ends[0]
+    a, b = anchored_start(
+        s[s_end::-1], t[t_end::-1], scores, alpha, beta, score
+    )
+    s_start, t_start = int(s_end - a), int(t_end - b)
+    res, s_ans, t_ans = affine_gap_alignment(
+        s[s_start : s_end + 1],
+        t[t_start : t_end + 1],
+        (s.alphabet, scores),
+        alpha,
+        beta,
+        wavefront=True,
+    )
+    assert res == score
+    return score, s_start, t_start, s_ans, t_ans
+
+
+def smith_waterman_batch(s, targets, cost_matrix, alpha, beta):
+    # local scores of one query against many targets, scanned together
+    s, _, scores = prepare(s, "", cost_matrix)
+    targets = [prepare(s, t, (s.alphabet, scores))[1] for t in targets]
+    profile = QueryProfile(s, s.alphabet, scores)
+    return striped_scan(profile, targets, alpha, beta)[0]
+
+
+def test(s, t, cost_matrix, alpha, beta):
+    score, s_start, t_start, *alignments = smith_waterman(
+        s, t, cost_matrix, alpha, beta, traceback=True
+    )
+    assert score == smith_waterman(s, t, cost_matrix, alpha, beta)
+    true_score = align.localds(
+        s, t, cost_matrix, alpha + beta, beta, score_only=True
+    )
+    assert score == max(true_score, 0), (score, true_score)
+    if score > 0:
+        a, b = (x.replace("-", "") for x in alignments)
+        assert s[s_start : s_start + len(a)] == a
+        assert t[t_start : t_start + len(b)] == b
+        assert score == affine_alignment_score(
+            *alignments, cost_matrix, alpha, beta
+        )
+
+
+def random_seq(alphabet, length):
+    return "".join(random.choices(alphabet, k=length))
+
+
+def main():
+    cost_matrix = substitution_matrices.load("BLOSUM62")
+    for _ in range(200):
+        alphabet = random.choice(("ACGT", "ACDEFGHIKLMNPQRSTVWY"))
+        s = random_seq(alphabet, random.randrange(1, 40))
+        t = random_seq(alphabet, random.randrange(1, 80))
+        for alpha, beta in ((-1, -1), (-10, -1), (-2, -2)):
+            test(s, t, cost_matrix, alpha, beta)
+
+    query = random_seq("ACGT", 30)
+    targets = [random_seq("ACGT", random.randrange(1, 200)) for _ in range(20)]
+    batch = smith_waterman_batch(query, targets, cost_matrix, -3, -1)
+    for t, score in zip(targets, batch):
+        assert score == smith_waterman(query, t, cost_matrix, -3, -1)
+    print("random tests passed")
+
+
+if __name__ == "__main__":
+    main()
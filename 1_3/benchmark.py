@@ -0,0 +1,48 @@
+import time
+
+from main import (
+    hirschberg_score_loop,
+    hirschberg_score_rows,
+    random_dna,
+)
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    res = fn(*args)
+    return res, time.perf_counter() - start
+
+
+def loop_split(s, t, costs):
+    mid = len(s) // 2
+    return (
+        hirschberg_score_loop(s[:mid], t, *costs),
+        hirschberg_score_loop(s[mid:][::-1], t[::-1], *costs),
+    )
+
+
+def batched_split(s, t, costs):
+    mid = len(s) // 2
+    return hirschberg_score_rows(
+        [s[:mid], s[mid:][::-1]], [t, t[::-1]], *costs
+    )
+
+
+def main():
+    costs = (-2, -2, 2, -1)
+    for length in (500, 1000, 5000):
+        s = random_dna(length)
+        t = random_dna(length)
+        (a, b), loop = timed(loop_split, s, t, costs)
+        (c, d), batched = timed(batched_split, s, t, costs)
+        assert (a == c).all() and (b == d).all()
+        print(
+            f"forward + reverse rows {length}x{length}:",
+            f"loop {loop:.3f}s,",
+            f"vectorized {batched:.3f}s,",
+            f"speedup {loop / batched:.1f}x",
+        )
+
+
+if __name__ == "__main__":
+    main()
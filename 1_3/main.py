@@ -1,17 +1,20 @@
 import random
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 
 import numpy as np
 from Bio.pairwise2 import align
 
-_BLANK = "-"
-
+from encoding import EncodedSeq, encode_all, match_matrix
 
-def scorer(match_cost, mismatch_cost):
-    return lambda a, b: match_cost if a == b else mismatch_cost
+_BLANK = "-"
+_EMPTY = 255
+_PARALLEL_CELLS = 1 << 22
 
 
 def needleman_wunsch(s, t, del_cost, ins_cost, match_cost, mismatch_cost):
-    score_fn = scorer(match_cost, mismatch_cost)
+    (s, t), alphabet = encode_all([s, t])
+    scores = match_matrix(alphabet, match_cost, mismatch_cost)
     n, m = len(s), len(t)
 
     res = np.zeros((n + 1, m + 1))
@@ -19,9 +22,10 @@ def needleman_wunsch(s, t, del_cost, ins_cost, match_cost, mismatch_cost):
     res[0, ...] = np.arange(m + 1) * ins_cost
 
     for i in range(n):
+        row = scores[s.codes[i]][t.codes].tolist()
         for j in range(m):
             res[i + 1, j + 1] = max(
-                res[i][j] + score_fn(s[i], t[j]),
+                res[i][j] + row[j],
                 res[i + 1][j] + ins_cost,
                 res[i][j + 1] + del_cost,
             )
@@ -36,7 +40,7 @@ def needleman_wunsch(s, t, del_cost, ins_cost, match_cost, mismatch_cost):
             t_ans.append(t[j])
             s_ans.append(_BLANK)
             j -= 1
-        elif res[i + 1, j + 1] == res[i, j] + score_fn(s[i], t[j]):
+        elif res[i + 1, j + 1] == res[i, j] + scores[s.codes[i], t.codes[j]]:
             s_ans.append(s[i])
             t_ans.append(t[j])
             i -= 1
@@ -53,71 +57,322 @@ def needleman_wunsch(s, t, del_cost, ins_cost, match_cost, mismatch_cost):
     return res[n][m], s_ans[::-1], t_ans[::-1]
 
 
-def hirschberg_score(s, t, del_cost, ins_cost, match_cost, mismatch_cost):
+def hirschberg_score_loop(s, t, del_cost, ins_cost, match_cost, mismatch_cost):
+    (s, t), alphabet = encode_all([s, t])
     n, m = len(s), len(t)
     res = np.array([[i * ins_cost for i in range(m + 1)], [0] * (m + 1)])
     k = 0
-    score_fn = scorer(match_cost, mismatch_cost)
+    scores = match_matrix(alphabet, match_cost, mismatch_cost)
     for i in range(n):
         k ^= 1
         res[k][0] = (i + 1) * del_cost
+        row = scores[s.codes[i]][t.codes].tolist()
         for j in range(m):
             res[k][j + 1] = max(
-                res[k ^ 1][j] + score_fn(s[i], t[j]),
+                res[k ^ 1][j] + row[j],
                 res[k][j] + ins_cost,
                 res[k ^ 1][j + 1] + del_cost,
             )
     return res[k]
 
 
-def hirschberg(
-    s, t, del_cost, ins_cost, match_cost, mismatch_cost, vis=False, depth=0
+def hirschberg_score_rows(
+    ss, ts, del_cost, ins_cost, match_cost, mismatch_cost
 ):
-    n, m = len(s), len(t)
-    if n < 2 or m < 2:
+    # last DP rows of all the pairs (ss[b], ts[b]) at once, every ts[b] has
+    # the same length; the insertion chain within a row is a running max:
+    # row[j] = max_{k <= j} (x[k] + ins_cost * (j - k))
+    seqs, alphabet = encode_all(list(ss) + list(ts))
+    ss, ts = seqs[: len(ss)], seqs[len(ss) :]
+    batch, m = len(ts), len(ts[0])
+    scores = match_matrix(alphabet, match_cost, mismatch_cost)
+    profile = scores[:, np.stack([t.codes for t in ts])]
+    lengths = np.array([len(s) for s in ss])
+    s_codes = np.zeros((max(lengths, default=0), batch), dtype=np.uint8)
+    for b, s in enumerate(ss):
+        s_codes[: len(s), b] = s.codes
+
+    steps = np.arange(m + 1) * ins_cost
+    dtype = np.result_type(steps, del_cost, scores)
+    rows = np.tile(steps.astype(dtype), (batch, 1))
+    live = np.arange(batch)
+    for i in range(len(s_codes)):
+        if i < lengths.min():
+            rows = hirschberg_row(
+                rows, profile[s_codes[i], live], del_cost, i, steps
+            )
+        else:  # some pairs are done, update the rest
+            cur = np.flatnonzero(lengths > i)
+            rows[cur] = hirschberg_row(
+                rows[cur], profile[s_codes[i, cur], cur], del_cost, i, steps
+            )
+    return rows
+
+
+def hirschberg_row(prev, row_scores, del_cost, i, steps):
+    x = np.empty_like(prev)
+    x[:, 0] = (i + 1) * del_cost
+    np.maximum(prev[:, :-1] + row_scores, prev[:, 1:] + del_cost, out=x[:, 1:])
+    x -= steps
+    res = np.maximum.accumulate(x, axis=1)
+    res += steps
+    return res
+
+
+def hirschberg_score(s, t, del_cost, ins_cost, match_cost, mismatch_cost):
+    return hirschberg_score_rows(
+        [s], [t], del_cost, ins_cost, match_cost, mismatch_cost
+    )[0]
+
+
+def hirschberg_split(s, t, costs):  # column where the path crosses row mid
+    mid = len(s) // 2
+    score_a, score_b = hirschberg_score_rows(
+        [s[:mid], s[mid:][::-1]], [t, t[::-1]], *costs
+    )
+    return int((score_a + score_b[::-1]).argmax())
+
+
+def hirschberg_base(s, t, costs, out_s, out_t, offset):
+    # the alignment of s[s_lo:s_hi] and t[t_lo:t_hi] is not longer than
+    # (s_hi - s_lo) + (t_hi - t_lo), so writing it at s_lo + t_lo keeps
+    # the segments of all base cases disjoint and in order
+    _, s_ans, t_ans = needleman_wunsch(s, t, *costs)
+    codes = {c: i for i, c in enumerate(s.alphabet + _BLANK)}
+    out_s[offset : offset + len(s_ans)] = [codes[c] for c in s_ans]
+    out_t[offset : offset + len(t_ans)] = [codes[c] for c in t_ans]
+
+
+def hirschberg_rec(s, t, bounds, costs, out_s, out_t, vis=False, depth=0):
+    s_lo, s_hi, t_lo, t_hi = bounds
+    cur_s, cur_t = s[s_lo:s_hi], t[t_lo:t_hi]
+    if s_hi - s_lo < 2 or t_hi - t_lo < 2:
         if vis:
-            print("  " * depth, f"({s}, {t})")
-        return needleman_wunsch(
-            s, t, del_cost, ins_cost, match_cost, mismatch_cost
-        )
+            print("  " * depth, f"({cur_s}, {cur_t})")
+        hirschberg_base(cur_s, cur_t, costs, out_s, out_t, s_lo + t_lo)
+        return
+    mid = s_lo + (s_hi - s_lo) // 2
+    idx = t_lo + hirschberg_split(cur_s, cur_t, costs)
+    lhs, rhs = (s_lo, mid, t_lo, idx), (mid, s_hi, idx, t_hi)
+    hirschberg_rec(s, t, lhs, costs, out_s, out_t, vis, depth + 1)
+    if vis:
+        print("  " * depth, f"({cur_s}, {cur_t})")
+    hirschberg_rec(s, t, rhs, costs, out_s, out_t, vis, depth + 1)
+
+
+_worker_buffers = None
+
+
+def _attach_buffers(alphabet, specs):
+    global _worker_buffers
+    shms = [shared_memory.SharedMemory(name) for name, _ in specs]
+    arrays = [
+        np.ndarray(size, dtype=np.uint8, buffer=shm.buf)
+        for shm, (_, size) in zip(shms, specs)
+    ]
+    s, t = EncodedSeq(arrays[0], alphabet), EncodedSeq(arrays[1], alphabet)
+    _worker_buffers = shms, s, t, arrays[2], arrays[3]
+
+
+def _hirschberg_split_task(bounds, costs):
+    _, s, t, _, _ = _worker_buffers
+    s_lo, s_hi, t_lo, t_hi = bounds
+    return t_lo + hirschberg_split(s[s_lo:s_hi], t[t_lo:t_hi], costs)
+
+
+def _hirschberg_solve_task(bounds, costs):
+    _, s, t, out_s, out_t = _worker_buffers
+    hirschberg_rec(s, t, bounds, costs, out_s, out_t)
+
+
+def hirschberg_parallel(s, t, costs, out_s, out_t, n_jobs, min_cells):
+    # splits of subproblems with at least min_cells cells are computed
+    # level by level in the pool, smaller subproblems are solved there
+    # whole; everything reads and writes the same shared buffers
+    buffers = (s.codes, t.codes, out_s, out_t)
+    shms = [
+        shared_memory.SharedMemory(create=True, size=max(1, len(x)))
+        for x in buffers
+    ]
+    try:
+        for shm, x in zip(shms, buffers):
+            np.ndarray(len(x), dtype=np.uint8, buffer=shm.buf)[:] = x
+        specs = [(shm.name, len(x)) for shm, x in zip(shms, buffers)]
+        with ProcessPoolExecutor(
+            n_jobs, initializer=_attach_buffers, initargs=(s.alphabet, specs)
+        ) as pool:
+            solved = []
+            pending = [(0, len(s), 0, len(t))]
+            while pending:
+                big = []
+                for bounds in pending:
+                    s_lo, s_hi, t_lo, t_hi = bounds
+                    n, m = s_hi - s_lo, t_hi - t_lo
+                    if n >= 2 and m >= 2 and n * m >= min_cells:
+                        big.append(bounds)
+                    else:
+                        solved.append(
+                            pool.submit(_hirschberg_solve_task, bounds, costs)
+                        )
+                splits = pool.map(
+                    _hirschberg_split_task, big, [costs] * len(big)
+                )
+                pending = []
+                for (s_lo, s_hi, t_lo, t_hi), idx in zip(big, splits):
+                    mid = s_lo + (s_hi - s_lo) // 2
+                    pending.append((s_lo, mid, t_lo, idx))
+                    pending.append((mid, s_hi, idx, t_hi))
+            for future in solved:
+                future.result()
+        out_s[:] = np.ndarray(len(out_s), dtype=np.uint8, buffer=shms[2].buf)
+        out_t[:] = np.ndarray(len(out_t), dtype=np.uint8, buffer=shms[3].buf)
+    finally:
+        for shm in shms:
+            shm.close()
+            shm.unlink()
+
+
+def hirschberg(
+    s,
+    t,
+    del_cost,
+    ins_cost,
+    match_cost,
+    mismatch_cost,
+    vis=False,
+    n_jobs=1,
+    min_parallel_cells=_PARALLEL_CELLS,
+):
+    (s, t), alphabet = encode_all([s, t])
+    costs = (del_cost, ins_cost, match_cost, mismatch_cost)
+    out_s = np.full(len(s) + len(t), _EMPTY, dtype=np.uint8)
+    out_t = out_s.copy()
+    if n_jobs == 1 or vis:
+        bounds = (0, len(s), 0, len(t))
+        hirschberg_rec(s, t, bounds, costs, out_s, out_t, vis)
     else:
-        mid = n // 2
-        score_a = hirschberg_score(
-            s[:mid], t, del_cost, ins_cost, match_cost, mismatch_cost
-        )
-        score_b = hirschberg_score(
-            s[mid:][::-1],
-            t[::-1],
-            del_cost,
-            ins_cost,
-            match_cost,
-            mismatch_cost,
-        )
-        idx = (score_a + score_b[::-1]).argmax()
-        del score_a, score_b
-        lhs = hirschberg(
-            s[:mid],
-            t[:idx],
-            del_cost,
-            ins_cost,
-            match_cost,
-            mismatch_cost,
-            vis,
-            depth + 1,
+        hirschberg_parallel(
+            s, t, costs, out_s, out_t, n_jobs, min_parallel_cells
         )
-        if vis:
-            print("  " * depth, f"({s}, {t})")
-        rhs = hirschberg(
-            s[mid:],
-            t[idx:],
-            del_cost,
-            ins_cost,
-            match_cost,
-            mismatch_cost,
-            vis,
-            depth + 1,
+    keep = out_s != _EMPTY
+    out_s, out_t = out_s[keep], out_t[keep]
+
+    blank = len(alphabet)  # gaps are coded after the symbols
+    s_gap, t_gap = out_s == blank, out_t == blank
+    both = ~(s_gap | t_gap)
+    scores = match_matrix(alphabet, match_cost, mismatch_cost)
+    score = (
+        ins_cost * s_gap.sum()
+        + del_cost * t_gap.sum()
+        + scores[out_s[both], out_t[both]].sum()
+    )
+    alphabet += _BLANK
+    return score, [alphabet[c] for c in out_s], [alphabet[c] for c in out_t]
+
+
+def gap_score(length, alpha, beta):
+    return alpha + beta * length if length > 0 else 0
+
+
+def affine_alignment_score(a, b, alpha, beta, match_cost, mismatch_cost):
+    assert len(a) == len(b)
+    score = 0
+    prev = None
+    for x, y in zip(a, b):
+        if x == _BLANK or y == _BLANK:
+            cur = x == _BLANK
+            score += beta if cur == prev else alpha + beta
+            prev = cur
+        else:
+            score += match_cost if x == y else mismatch_cost
+            prev = None
+    return score
+
+
+def affine_score_rows(s, t, scores, alpha, beta, tb):
+    # last row of the Gotoh DP of s against t: cc is the best score in any
+    # state and dd the best score ending in a deletion; tb is the opening
+    # cost of a deletion gap starting at the top left corner
+    m = len(t)
+    steps = np.arange(m + 1)
+    cc = alpha + beta * steps.astype(np.float64)
+    cc[0] = 0
+    dd = cc + alpha
+    for i in range(len(s)):
+        dd = np.maximum(dd, cc + alpha) + beta
+        x = np.empty(m + 1)
+        x[0] = tb + beta * (i + 1)
+        x[1:] = np.maximum(dd[1:], cc[:-1] + scores[s.codes[i]][t.codes])
+        # an insertion run ending at j opens after the best x_k, k < j
+        e = np.full(m + 1, -np.inf)
+        e[1:] = np.maximum.accumulate(x - beta * steps)[:-1]
+        e[1:] += alpha + beta * steps[1:]
+        cc = np.maximum(x, e)
+        dd[0] = cc[0]
+    return cc, dd
+
+
+def myers_miller_single(s, t, scores, alpha, beta, tb, te):
+    # s of length 1: either delete it (merging into a boundary deletion
+    # when tb or te is free) and insert all of t, or align it to one t[j]
+    m = len(t)
+    best = max(tb, te) + beta + gap_score(m, alpha, beta)
+    best_j = -1
+    for j in range(m):
+        cur = (
+            gap_score(j, alpha, beta)
+            + scores[s.codes[0], t.codes[j]]
+            + gap_score(m - j - 1, alpha, beta)
         )
-        return [lhs[i] + rhs[i] for i in range(3)]
+        if cur > best:
+            best, best_j = cur, j
+    if best_j < 0:
+        if tb >= te:
+            return [s[0]] + [_BLANK] * m, [_BLANK] + list(t)
+        return [_BLANK] * m + [s[0]], list(t) + [_BLANK]
+    s_ans = [_BLANK] * best_j + [s[0]] + [_BLANK] * (m - best_j - 1)
+    return s_ans, list(t)
+
+
+def myers_miller_rec(s, t, scores, alpha, beta, tb, te):
+    n, m = len(s), len(t)
+    if m == 0:
+        return list(s), [_BLANK] * n
+    if n == 0:
+        return [_BLANK] * m, list(t)
+    if n == 1:
+        return myers_miller_single(s, t, scores, alpha, beta, tb, te)
+
+    mid = n // 2
+    cc, dd = affine_score_rows(s[:mid], t, scores, alpha, beta, tb)
+    rr, ss = affine_score_rows(s[mid:][::-1], t[::-1], scores, alpha, beta, te)
+    # type 1 joins at a node of row mid, type 2 inside a deletion gap
+    # crossing it, whose opening cost is counted by both halves
+    join_1 = cc + rr[::-1]
+    join_2 = dd + ss[::-1] - alpha
+    j1, j2 = join_1.argmax(), join_2.argmax()
+    if join_1[j1] >= join_2[j2]:
+        lhs = myers_miller_rec(s[:mid], t[:j1], scores, alpha, beta, tb, alpha)
+        rhs = myers_miller_rec(s[mid:], t[j1:], scores, alpha, beta, alpha, te)
+        return lhs[0] + rhs[0], lhs[1] + rhs[1]
+    lhs = myers_miller_rec(s[: mid - 1], t[:j2], scores, alpha, beta, tb, 0)
+    rhs = myers_miller_rec(s[mid + 1 :], t[j2:], scores, alpha, beta, 0, te)
+    return (
+        lhs[0] + [s[mid - 1], s[mid]] + rhs[0],
+        lhs[1] + [_BLANK, _BLANK] + rhs[1],
+    )
+
+
+def myers_miller(s, t, alpha, beta, match_cost, mismatch_cost):
+    # affine gaps (a gap of length k costs alpha + k * beta) in O(n + m)
+    # memory, same recurrences as affine_gap_alignment in 1_2
+    (s, t), alphabet = encode_all([s, t])
+    scores = match_matrix(alphabet, match_cost, mismatch_cost)
+    s_ans, t_ans = myers_miller_rec(s, t, scores, alpha, beta, alpha, alpha)
+    score = affine_alignment_score(
+        s_ans, t_ans, alpha, beta, match_cost, mismatch_cost
+    )
+    return score, s_ans, t_ans
 
 
 def test(s, t, del_cost, ins_cost, match_cost, mismatch_cost):
@@ -130,6 +385,24 @@ def test(s, t, del_cost, ins_cost, match_cost, mismatch_cost):
     assert score == true_score, (score, true_score)
 
 
+def test_parallel(s, t, del_cost, ins_cost, match_cost, mismatch_cost):
+    costs = (del_cost, ins_cost, match_cost, mismatch_cost)
+    expected = hirschberg(s, t, *costs)
+    assert expected == hirschberg(s, t, *costs, n_jobs=2, min_parallel_cells=4)
+
+
+def test_affine(s, t, alpha, beta, match_cost, mismatch_cost):
+    score, *alignments = myers_miller(
+        s, t, alpha, beta, match_cost, mismatch_cost
+    )
+    assert [c for c in alignments[0] if c != _BLANK] == list(s)
+    assert [c for c in alignments[1] if c != _BLANK] == list(t)
+    true_score = align.globalms(
+        s, t, match_cost, mismatch_cost, alpha + beta, beta, score_only=True
+    )
+    assert score == true_score, (score, true_score)
+
+
 def random_dna(length):
     return "".join(random.choices(("A", "G", "T", "C"), k=length))
 
@@ -139,6 +412,7 @@ def main():
     ins_cost = -2
     match_cost = 2
     mismatch_cost = -1
+    costs = (del_cost, ins_cost, match_cost, mismatch_cost)
 
     # rand tests
     n_tests = 100
@@ -148,8 +422,24 @@ def main():
         s = random_dna(random.randrange(max_len - 1) + 1)
         t = random_dna(random.randrange(max_len - 1) + 1)
         test(s, t, del_cost, ins_cost, match_cost, mismatch_cost)
+        for alpha, beta in ((-1, -1), (-3, -1), (-2, -2)):
+            test_affine(s, t, alpha, beta, match_cost, mismatch_cost)
     print("random tests passed")
 
+    # any characters are compared, as strings were before encoding
+    assert hirschberg("ACGNT", "ACNT", *costs)[0] == 6.0
+    for s, t in (("ACGNT", "ACNT"), ("acgtN", "ACGT"), ("MKVLAT", "MKLLT")):
+        test(s, t, *costs)
+        test_parallel(s, t, *costs)
+        test_affine(s, t, -3, -1, match_cost, mismatch_cost)
+    print("alphabet tests passed")
+
+    for length in (1, 50, 300):
+        s = random_dna(length)
+        t = random_dna(random.randrange(length) + 1)
+        test_parallel(s, t, del_cost, ins_cost, match_cost, mismatch_cost)
+    print("parallel tests passed")
+
     # vis test
     # left call is upper, right call is lower, offset represents depth
 
@@ -0,0 +1,247 @@
+import itertools
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import hmm
+from hmm import HMM, backward_blocks, forward_checkpoints, random_model
+
+_worker_state = None
+
+
+class Counts:
+    # expected start, transition and emission counts (and first symbol
+    # counts of a context model) summed over sequences with their
+    # log-likelihoods; counts of disjoint sets of sequences add up
+    def __init__(self, model):
+        self.start = np.zeros_like(model.start)
+        self.transition = np.zeros_like(model.transition)
+        self.emission = np.zeros_like(model.emission)
+        self.first = (
+            None if model.first is None else np.zeros_like(model.first)
+        )
+        self.loglik = 0.0
+
+    def merge(self, other):
+        self.start += other.start
+        self.transition += other.transition
+        self.emission += other.emission
+        if self.first is not None:
+            self.first += other.first
+        self.loglik += other.loglik
+        return self
+
+
+def expected_counts(codes, model):
+    # E-step for one sequence over the checkpointed blocks of the scaled
+    # forward-backward; symbol counts are a bincount of (state, symbol)
+    # codes weighted by the posteriors, transition counts one matrix
+    # product per block
+    res = Counts(model)
+    checkpoints, res.loglik = forward_checkpoints(codes, model)
+    m = len(model)
+    k = model.emission.shape[-1]
+    context = model.emission.ndim == 3
+    states = np.arange(m) * k ** (model.emission.ndim - 1)
+    for lo, hi, prev, alpha, beta in backward_blocks(
+        codes, model, checkpoints
+    ):
+        gamma = alpha * beta
+        gamma /= gamma.sum(axis=1, keepdims=True)
+        cur = codes[lo:hi].astype(np.intp)
+        if lo == 0:
+            res.start += gamma[0]
+            if context:
+                res.first[:, cur[0]] += gamma[0]
+
+        # xi_i(a, b) ~ alpha_{i-1}(a) transition(a, b) e_i(b) beta_i(b)
+        first = max(lo, 1)
+        before = alpha[:-1] if lo == 0 else np.vstack([prev, alpha[:-1]])
+        after = model.emissions(codes, first, hi) * beta[first - lo :]
+        z = ((before @ model.transition) * after).sum(axis=1)
+        res.transition += model.transition * ((before / z[:, None]).T @ after)
+
+        if context:
+            cur = (
+                codes[first - 1 : hi - 1].astype(np.intp) * k
+                + cur[first - lo :]
+            )
+            gamma = gamma[first - lo :]
+        pairs = states + cur[:, None]
+        res.emission += np.bincount(
+            pairs.ravel(), gamma.ravel(), res.emission.size
+        ).reshape(res.emission.shape)
+    return res
+
+
+def normalize(counts, old):
+    # rows of counts summing to 1, rows never visited keep old
+    total = counts.sum(axis=-1, keepdims=True)
+    with np.errstate(invalid="ignore"):
+        return np.where(total > 0, counts / total, old)
+
+
+def maximize(counts, model):
+    # M-step: the model maximizing the expected log-likelihood
+    return HMM(
+        normalize(counts.start, model.start),
+        normalize(counts.transition, model.transition),
+        normalize(counts.emission, model.emission),
+        None if model.first is None else normalize(counts.first, model.first),
+    )
+
+
+def _init_worker(seqs):
+    global _worker_state
+    _worker_state = seqs
+
+
+def _batch_counts(args):
+    # counts of a batch of the worker's sequences, summed in the worker
+    idxs, model = args
+    res = Counts(model)
+    for i in idxs:
+        res.merge(expected_counts(_worker_state[i], model))
+    return res
+
+
+def baum_welch(seqs, model, max_iter=100, tol=1e-6, n_jobs=1, verbose=False):
+    # trains model on the code arrays seqs until the log-likelihood gains
+    # less than tol per symbol; every iteration sums the expected counts
+    # of batches of sequences, scored in a process pool with n_jobs > 1,
+    # and returns the model with (log-likelihood, seconds) per iteration
+    n_symbols = max(sum(len(s) for s in seqs), 1)
+    batches = np.array_split(np.arange(len(seqs)), max(1, 4 * n_jobs))
+    history = []
+    pool = None
+    if n_jobs > 1:
+        pool = ProcessPoolExecutor(
+            n_jobs, initializer=_init_worker, initargs=(seqs,)
+        )
+    try:
+        for it in range(max_iter):
+            start = time.perf_counter()
+            counts = Counts(model)
+            if pool is None:
+                for seq in seqs:
+                    counts.merge(expected_counts(seq, model))
+            else:
+                tasks = [(batch, model) for batch in batches]
+                for res in pool.map(_batch_counts, tasks):
+                    counts.merge(res)
+            model = maximize(counts, model)
+            history.append((counts.loglik, time.perf_counter() - start))
+            if verbose:
+                print(
+                    f"iteration {it + 1}: log-likelihood {counts.loglik:.4f}",
+                    f"in {history[-1][1]:.2f}s",
+                )
+            if it and counts.loglik - history[-2][0] < tol * n_symbols:
+                break
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return model, history
+
+
+def sample(model, n, rng):
+    # n symbol codes emitted by model
+    m, k = len(model), model.emission.shape[-1]
+    states = np.empty(n, dtype=np.intp)
+    codes = np.empty(n, dtype=np.uint8)
+    for i in range(n):
+        if i == 0:
+            states[i] = rng.choice(m, p=model.start)
+        else:
+            states[i] = rng.choice(m, p=model.transition[states[i - 1]])
+        if model.emission.ndim == 2:
+            p = model.emission[states[i]]
+        elif i == 0:
+            p = model.first[states[i]]
+        else:
+            p = model.emission[states[i], codes[i - 1]]
+        codes[i] = rng.choice(k, p=p)
+    return codes
+
+
+def brute_force_counts(codes, model):
+    # expected counts summed over every state path, for the tests
+    n, m = len(codes), len(model)
+    res = Counts(model)
+    total = 0.0
+    for path in itertools.product(range(m), repeat=n):
+        path = np.array(path)
+        p = model.start[path[0]] * np.prod(
+            model.transition[path[:-1], path[1:]]
+        )
+        p *= np.prod(model.emissions(codes, 0, n)[np.arange(n), path])
+        total += p
+        res.start[path[0]] += p
+        np.add.at(res.transition, (path[:-1], path[1:]), p)
+        if model.emission.ndim == 2:
+            np.add.at(res.emission, (path, codes), p)
+        else:
+            res.first[path[0], codes[0]] += p
+            np.add.at(res.emission, (path[1:], codes[:-1], codes[1:]), p)
+    for name in ("start", "transition", "emission", "first"):
+        if getattr(res, name) is not None:
+            getattr(res, name)[...] /= total
+    res.loglik = np.log(total)
+    return res
+
+
+def test_counts(n, m, k, context):
+    model = random_model(m, k, context)
+    codes = np.random.randint(0, k, n).astype(np.uint8)
+    res = expected_counts(codes, model)
+    expected = brute_force_counts(codes, model)
+    for name in ("start", "transition", "emission", "first", "loglik"):
+        if getattr(res, name) is not None:
+            assert np.allclose(getattr(res, name), getattr(expected, name))
+
+
+def test_blocks():
+    # blocks of one or two positions, so short sequences that brute force
+    # can check cross blocks and checkpoints like long ones do
+    saved = hmm._BLOCK
+    try:
+        for hmm._BLOCK in (1, 2):
+            for n in (3, 5, 7):
+                for m, k in ((2, 3), (3, 2)):
+                    test_counts(n, m, k, context=False)
+                    test_counts(n, m, k, context=True)
+    finally:
+        hmm._BLOCK = saved
+
+
+def test_training(context):
+    rng = np.random.default_rng(0)
+    true_model = random_model(2, 4, context)
+    seqs = [sample(true_model, 2000, rng) for _ in range(8)]
+    model = random_model(2, 4, context)
+    trained, history = baum_welch(seqs, model, max_iter=15, tol=0)
+    logliks = [loglik for loglik, _ in history]
+    assert len(history) == 15
+    assert (np.diff(logliks) > -1e-6).all()
+
+    parallel, history = baum_welch(seqs, model, max_iter=15, tol=0, n_jobs=2)
+    assert np.allclose([loglik for loglik, _ in history], logliks)
+    assert np.allclose(parallel.transition, trained.transition)
+    assert np.allclose(parallel.emission, trained.emission)
+
+
+def main():
+    for n in (1, 2, 5):
+        for m, k in ((1, 2), (2, 3), (3, 2)):
+            test_counts(n, m, k, context=False)
+            test_counts(n, m, k, context=True)
+    test_blocks()
+    print("expected counts test passed")
+    test_training(context=False)
+    test_training(context=True)
+    print("training test passed")
+
+
+if __name__ == "__main__":
+    main()
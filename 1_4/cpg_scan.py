@@ -0,0 +1,205 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from encoding import DNA_CODES, N
+from fasta import MappedFasta
+from kmers import count_kmers
+
+_CHUNK = 1 << 22  # bases scored at once
+_SCALE = 1 << 16  # fixed-point units of a nat, so window sums are exact
+_NO_WINDOW = -(1 << 36)  # score of a pair with an N, no window survives
+
+
+def transitions(fname, pseudo=1.0):
+    # (4 x 4) P(cur | prev) over every record of a FASTA, read off its
+    # k = 2 KmerCounts like the notebook's freq_double
+    seqs = [seq for _, seq in MappedFasta(fname)]
+    return count_kmers(seqs, 2).transitions(pseudo)
+
+
+def log_odds(islands, nonislands):
+    # 5 x 5 table of log P(cur | prev, island) - log P(cur | prev, other)
+    # from two transition tables, flattened as prev * 5 + cur with N as
+    # code 4; pairs with an N score 0
+    table = np.zeros((5, 5))
+    table[:4, :4] = np.log(islands) - np.log(nonislands)
+    return table.ravel()
+
+
+def byte_pair_table(table):
+    # table in fixed point, indexed by two adjacent bytes of a sequence
+    # read as one uint16, so scoring needs neither codes nor pair codes
+    pairs = np.arange(1 << 16, dtype=np.uint16).view(np.uint8)
+    codes = DNA_CODES[pairs].reshape(-1, 2).astype(np.intp)
+    res = np.round(table[codes[:, 0] * 5 + codes[:, 1]] * _SCALE)
+    res = res.astype(np.int64)
+    res[(codes == N).any(axis=1)] = _NO_WINDOW
+    return res
+
+
+def pair_scores(seq, pair_table):
+    seq = np.ascontiguousarray(seq)
+    pairs = np.ndarray((len(seq) - 1,), np.uint16, seq, strides=(1,))
+    return np.take(pair_table, pairs)
+
+
+def hot_runs(scores, window, threshold):
+    # [first, last] window starts of every run of windows of window bases
+    # whose dinucleotides score above threshold on average and hold no N,
+    # and the fixed-point window sums
+    pairs = window - 1
+    total = np.empty(len(scores) + 1, dtype=np.int64)
+    total[0] = 0
+    np.cumsum(scores, out=total[1:])
+    sums = total[pairs:] - total[:-pairs]
+    hot = sums > max(threshold * pairs * _SCALE, _NO_WINDOW // 2)
+    edges = np.flatnonzero(hot[1:] != hot[:-1]) + 1
+    if hot[0]:
+        edges = np.concatenate([[0], edges])
+    if hot[-1]:
+        edges = np.append(edges, len(hot))
+    return edges[::2], edges[1::2] - 1, sums
+
+
+def scan(fasta, key, table, window=200, threshold=0.0, chunk=_CHUNK):
+    # (start, end, best window score) of the islands of a record: unions
+    # of overlapping hot windows; chunks overlap by window - 1 bases so
+    # every window lies in one chunk, and an island still open at the end
+    # of a chunk carries over to the next one
+    assert 1 < window < chunk < 1 << 26  # int64 sums cannot overflow
+    pair_table = byte_pair_table(table)
+    current = None
+    lo = 0
+    for seq in fasta.chunks(key, chunk, overlap=window - 1):
+        if len(seq) < window:
+            break
+        scores = pair_scores(seq, pair_table)
+        first, last, sums = hot_runs(scores, window, threshold)
+        for a, b in zip(first, last):
+            best = sums[a : b + 1].max() / ((window - 1) * _SCALE)
+            start, end = lo + a, lo + b + window
+            if current is not None and start <= current[1]:
+                current[1] = max(current[1], end)
+                current[2] = max(current[2], best)
+                continue
+            if current is not None:
+                yield tuple(current)
+            current = [start, end, best]
+        if current is not None and current[1] < lo + len(seq) - window + 1:
+            yield tuple(current)
+            current = None
+        lo += len(seq) - window + 1
+    if current is not None:
+        yield tuple(current)
+
+
+def naive_scan(seq, table, window, threshold):
+    # every window scored on its own in Python, overlapping or touching
+    # hot windows joined one by one
+    codes = ["ACGT".find(c) % 5 for c in seq.upper()]  # N is -1 % 5
+    scores = [
+        None if 4 in (a, b) else round(table[a * 5 + b] * _SCALE)
+        for a, b in zip(codes, codes[1:])
+    ]
+    pairs = window - 1
+    res = []
+    for start in range(len(seq) - window + 1):
+        window_scores = scores[start : start + pairs]
+        if None in window_scores:
+            continue
+        total = sum(window_scores)
+        if total <= threshold * pairs * _SCALE:
+            continue
+        best = total / (pairs * _SCALE)
+        if res and start <= res[-1][1]:
+            res[-1] = (res[-1][0], start + window, max(res[-1][2], best))
+        else:
+            res.append((start, start + window, best))
+    return res
+
+
+def test(tmp):
+    # random records with runs of N and lowercase, cut into random chunks
+    rng = np.random.default_rng(0)
+    table = log_odds(*rng.dirichlet(np.ones(4), (2, 4)))
+    records = []
+    for _ in range(12):
+        seq = rng.choice(list("ACGTacgt"), rng.integers(0, 400))
+        for pos in rng.integers(0, max(len(seq), 1), rng.integers(0, 4)):
+            seq[pos : pos + rng.integers(1, 4)] = "N"
+        records.append("".join(seq))
+    fname = os.path.join(tmp, "genome.fasta")
+    with open(fname, "w") as f:
+        for i, seq in enumerate(records):
+            width = int(rng.integers(1, 80))
+            lines = [seq[j : j + width] for j in range(0, len(seq), width)]
+            print(f">r{i}", *lines, sep="\n", file=f)
+    fasta = MappedFasta(fname)
+    for _ in range(30):
+        window = int(rng.integers(2, 30))
+        chunk = int(rng.integers(window + 1, 4 * window + 2))
+        threshold = float(rng.normal(0, 0.2))
+        for i, seq in enumerate(records):
+            res = list(scan(fasta, i, table, window, threshold, chunk))
+            expected = naive_scan(seq, table, window, threshold)
+            assert [r[:2] for r in res] == [r[:2] for r in expected]
+            assert np.allclose([r[2] for r in res], [r[2] for r in expected])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="CpG islands of a FASTA genome as BED records"
+    )
+    parser.add_argument("genome", nargs="?")
+    parser.add_argument("--islands", default="data/islands.fasta")
+    parser.add_argument("--nonislands", default="data/nonIslands.fasta")
+    parser.add_argument("--window", type=int, default=200)
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="least mean log-odds per dinucleotide of a window",
+    )
+    parser.add_argument("--chunk", type=int, default=_CHUNK)
+    parser.add_argument("-o", "--out", help="BED file, stdout by default")
+    parser.add_argument("--test", action="store_true", help="self-check")
+    args = parser.parse_args()
+    if args.test:
+        with tempfile.TemporaryDirectory() as tmp:
+            test(tmp)
+        print("island scan test passed")
+        return
+    if args.genome is None:
+        parser.error("genome is required")
+
+    table = log_odds(transitions(args.islands), transitions(args.nonislands))
+    fasta = MappedFasta(args.genome)
+    out = open(args.out, "w") if args.out else sys.stdout
+    start_time = time.perf_counter()
+    n_bases = n_islands = 0
+    try:
+        for i, e in enumerate(fasta.index):
+            for start, end, score in scan(
+                fasta, i, table, args.window, args.threshold, args.chunk
+            ):
+                print(e.name, start, end, f"{score:.4f}", sep="\t", file=out)
+                n_islands += 1
+            n_bases += e.length
+    finally:
+        if args.out:
+            out.close()
+    elapsed = time.perf_counter() - start_time
+    print(
+        f"{n_islands} islands in {n_bases} bases,",
+        f"{n_bases / max(elapsed, 1e-9) / 1e6:.1f} Mb/s",
+        file=sys.stderr,
+    )
+
+
+if __name__ == "__main__":
+    main()
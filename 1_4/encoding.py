@@ -0,0 +1,20 @@
+import numpy as np
+
+DNA = "ACGT"
+N = 4  # code of N and any other non-ACGT symbol in DNA_CODES
+
+DNA_CODES = np.full(256, N, dtype=np.uint8)
+for _i, _c in enumerate(DNA):
+    DNA_CODES[ord(_c)] = DNA_CODES[ord(_c.lower())] = _i
+
+
+def encode(s, alphabet=DNA):
+    # symbol codes of a str or of an ASCII uint8 array (MappedFasta)
+    lut = np.full(256, 255, dtype=np.uint8)
+    for i, c in enumerate(alphabet):
+        lut[ord(c)] = lut[ord(c.lower())] = i
+    if isinstance(s, str):
+        s = np.frombuffer(s.encode(), dtype=np.uint8)
+    codes = lut[s]
+    assert (codes != 255).all(), f"symbol out of alphabet {alphabet}"
+    return codes
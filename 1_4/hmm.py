@@ -0,0 +1,244 @@
+import math
+
+import numpy as np
+
+from encoding import encode
+
+_BLOCK = 1 << 14  # fewest positions scanned together
+
+
+class HMM:
+    # start (m), transition (m x m) and emission probabilities, either
+    # (m x k) or, conditioned on the previous symbol, (m x k x k) with the
+    # first symbol emitted by first (m x k)
+    def __init__(self, start, transition, emission, first=None):
+        self.start = np.asarray(start, dtype=np.float64)
+        self.transition = np.asarray(transition, dtype=np.float64)
+        self.emission = np.asarray(emission, dtype=np.float64)
+        if self.emission.ndim == 3:
+            assert first is not None
+            first = np.asarray(first, dtype=np.float64)
+        self.first = first
+
+    def __len__(self):
+        return len(self.start)
+
+    def emissions(self, codes, lo, hi):
+        # (hi - lo) x m probabilities of symbols lo..hi-1 in every state
+        cur = codes[lo:hi]
+        if self.emission.ndim == 2:
+            return self.emission[:, cur].T
+        res = np.empty((hi - lo, len(self)))
+        k = 0
+        if lo == 0 and hi > 0:
+            res[0] = self.first[:, cur[0]]
+            k = 1
+        res[k:] = self.emission[:, codes[lo + k - 1 : hi - 1], cur[k:]].T
+        return res
+
+    def transfers(self, codes, lo, hi):
+        # M_i = transition * e_i for positions lo..hi-1 (lo >= 1), so that
+        # alpha_i = alpha_{i-1} @ M_i and beta_{i-1} = M_i @ beta_i; the
+        # stack is (m x m x positions) so every entry is one contiguous row
+        e = self.emissions(codes, lo, hi)
+        return self.transition[:, :, None] * e.T[None, :, :]
+
+
+def matmul(a, b):
+    # products of (m x m x positions) stacks, one vector op per term
+    m = len(a)
+    res = np.empty((m, m, a.shape[2]))
+    for i in range(m):
+        for j in range(m):
+            res[i, j] = a[i, 0] * b[0, j]
+            for k in range(1, m):
+                res[i, j] += a[i, k] * b[k, j]
+    return res
+
+
+def normalize(prods, logs):
+    # scale every matrix of the stack to a largest entry of 1
+    m = len(prods)
+    scale = prods.reshape(m * m, -1).max(axis=0)
+    prods /= scale
+    logs += np.log(scale)
+
+
+def scan_products(mats):
+    # prefix products of a (m x m x positions) stack by recursive
+    # doubling, each scaled to a largest entry of 1 with the log of the
+    # scale kept apart
+    prods = mats.copy()
+    logs = np.zeros(mats.shape[2])
+    normalize(prods, logs)
+    shift = 1
+    while shift < mats.shape[2]:
+        prods[:, :, shift:] = matmul(prods[:, :, :-shift], prods[:, :, shift:])
+        logs[shift:] = logs[:-shift] + logs[shift:]
+        normalize(prods[:, :, shift:], logs[shift:])
+        shift *= 2
+    return prods, logs
+
+
+def forward_block(model, codes, lo, hi, alpha):
+    # alphas of positions lo..hi-1, each scaled to sum 1, from the alpha
+    # of lo - 1 (unused for lo = 0) and the log-likelihood they add
+    res = np.empty((hi - lo, len(model)))
+    loglik = 0.0
+    if lo == 0:
+        v = model.start * model.emissions(codes, 0, 1)[0]
+        alpha = res[0] = v / v.sum()
+        loglik = np.log(v.sum())
+    first = max(lo, 1)
+    if first < hi:
+        prods, logs = scan_products(model.transfers(codes, first, hi))
+        v = np.tensordot(alpha, prods, 1)
+        s = v.sum(axis=0)
+        res[first - lo :] = (v / s).T
+        loglik += logs[-1] + np.log(s[-1])
+    return res, loglik
+
+
+def backward_block(model, codes, lo, hi, beta):
+    # betas of positions lo..hi-1, each scaled to sum 1, from the beta of
+    # hi (None past the end of the sequence)
+    n, m = len(codes), len(model)
+    res = np.empty((hi - lo, m))
+    end = min(hi, n - 1)
+    if beta is None:
+        beta = res[-1] = np.full(m, 1 / m)
+    if lo < end:
+        mats = model.transfers(codes, lo + 1, end + 1)
+        prods, _ = scan_products(mats[:, :, ::-1].transpose(1, 0, 2))
+        v = np.tensordot(beta, prods, 1)[:, ::-1]
+        res[: end - lo] = (v / v.sum(axis=0)).T
+    return res
+
+
+def forward(codes, model):
+    # scaled alphas of every position and the log-likelihood of codes
+    n = len(codes)
+    alpha = np.empty((n, len(model)))
+    loglik = 0.0
+    for lo in range(0, n, _BLOCK):
+        hi = min(lo + _BLOCK, n)
+        prev = alpha[lo - 1] if lo else None
+        alpha[lo:hi], inc = forward_block(model, codes, lo, hi, prev)
+        loglik += inc
+    return alpha, loglik
+
+
+def backward(codes, model):
+    n = len(codes)
+    beta = np.empty((n, len(model)))
+    for lo in reversed(range(0, n, _BLOCK)):
+        hi = min(lo + _BLOCK, n)
+        nxt = beta[hi] if hi < n else None
+        beta[lo:hi] = backward_block(model, codes, lo, hi, nxt)
+    return beta
+
+
+def forward_checkpoints(codes, model):
+    # (lo, hi, alpha of lo - 1) for every block of sqrt(n) positions and
+    # the log-likelihood; only these alphas are kept by the forward pass
+    n = len(codes)
+    block = max(_BLOCK, math.isqrt(n))
+    checkpoints = []
+    prev, loglik = None, 0.0
+    for lo in range(0, n, block):
+        hi = min(lo + block, n)
+        checkpoints.append((lo, hi, prev))
+        alpha, inc = forward_block(model, codes, lo, hi, prev)
+        prev = alpha[-1]
+        loglik += inc
+    return checkpoints, loglik
+
+
+def backward_blocks(codes, model, checkpoints):
+    # (lo, hi, alpha of lo - 1, alphas, betas) of every block from the
+    # last one, the alphas recomputed from the checkpoints, so apart from
+    # one block the memory is O(sqrt(n))
+    nxt = None
+    for lo, hi, prev in reversed(checkpoints):
+        alpha, _ = forward_block(model, codes, lo, hi, prev)
+        beta = backward_block(model, codes, lo, hi, nxt)
+        nxt = beta[0]
+        yield lo, hi, prev, alpha, beta
+
+
+def posterior(codes, model, out=None):
+    # state probabilities of every position and the log-likelihood
+    checkpoints, loglik = forward_checkpoints(codes, model)
+    if out is None:
+        out = np.empty((len(codes), len(model)))
+    for lo, hi, _, alpha, beta in backward_blocks(codes, model, checkpoints):
+        gamma = alpha * beta
+        out[lo:hi] = gamma / gamma.sum(axis=1, keepdims=True)
+    return out, loglik
+
+
+def posterior_decode(codes, model):
+    return posterior(codes, model)[0].argmax(axis=1)
+
+
+def log_sum_exp(x, axis=None):
+    mx = np.max(x, axis=axis, keepdims=True)
+    return np.squeeze(mx + np.log(np.exp(x - mx).sum(axis, keepdims=True)))
+
+
+def naive_posterior(codes, model):
+    # log-space forward-backward one position at a time, for the tests
+    n = len(codes)
+    e = np.log(model.emissions(codes, 0, n))
+    log_t = np.log(model.transition)
+    f = np.zeros((n, len(model)))
+    b = np.zeros((n, len(model)))
+    f[0] = np.log(model.start) + e[0]
+    for i in range(1, n):
+        f[i] = e[i] + log_sum_exp(f[i - 1][:, None] + log_t, axis=0)
+    for i in range(n - 2, -1, -1):
+        b[i] = log_sum_exp(log_t + e[i + 1] + b[i + 1], axis=1)
+    loglik = log_sum_exp(f[-1])
+    return np.exp(f + b - loglik), loglik
+
+
+def random_model(m, k, context):
+    rng = np.random.default_rng()
+
+    def rows(*shape):
+        x = rng.random(shape) + 0.01
+        return x / x.sum(axis=-1, keepdims=True)
+
+    if context:
+        return HMM(rows(m), rows(m, m), rows(m, k, k), rows(m, k))
+    return HMM(rows(m), rows(m, m), rows(m, k))
+
+
+def test(n, m, k, context):
+    model = random_model(m, k, context)
+    codes = np.random.randint(0, k, n).astype(np.uint8)
+    expected, true_loglik = naive_posterior(codes, model)
+    gamma, loglik = posterior(codes, model)
+    assert np.allclose(gamma, expected)
+    assert np.isclose(loglik, true_loglik)
+
+    alpha, loglik = forward(codes, model)
+    beta = backward(codes, model)
+    gamma = alpha * beta
+    assert np.allclose(gamma / gamma.sum(axis=1, keepdims=True), expected)
+    assert np.isclose(loglik, true_loglik)
+    assert (posterior_decode(codes, model) == expected.argmax(axis=1)).all()
+
+
+def main():
+    assert (encode("ACgtT") == [0, 1, 2, 3, 3]).all()
+    for n in (1, 2, 3, 100, 16385):
+        for m, k in ((1, 2), (2, 4), (3, 5)):
+            test(n, m, k, context=False)
+            test(n, m, k, context=True)
+    test(40000, 2, 4, context=True)  # several checkpointed blocks
+    print("random tests passed")
+
+
+if __name__ == "__main__":
+    main()
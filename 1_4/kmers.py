@@ -0,0 +1,241 @@
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from encoding import DNA_CODES, N
+
+MAX_K = 16  # 2-bit codes of longer k-mers overflow uint32
+_DENSE_MAX = 1 << 22  # largest 4^k counted into a dense array
+_BUFFER = 1 << 22  # k-mer codes of many records binned together
+
+
+def kmer_codes(seq, k):
+    # 2-bit codes (first base in the high bits) of the k-mers of an ASCII
+    # uint8 array that hold no N, in order
+    assert 1 <= k <= MAX_K
+    codes = DNA_CODES[seq]
+    n = len(codes) - k + 1
+    if n <= 0:
+        return np.zeros(0, dtype=np.uint32)
+    res = np.zeros(n, dtype=np.uint32)
+    for shift in range(k):
+        res <<= np.uint32(2)
+        res |= codes[shift : shift + n] & 3
+    unknown = np.zeros(len(codes) + 1, dtype=np.int64)
+    np.cumsum(codes == N, out=unknown[1:])
+    return res[unknown[k:] == unknown[:-k]]
+
+
+def decode(code, k):
+    return "".join(
+        "ACGT"[(int(code) >> 2 * (k - 1 - i)) & 3] for i in range(k)
+    )
+
+
+def sum_sorted(codes, counts):
+    # codes sorted with the counts of equal codes added up
+    order = np.argsort(codes, kind="stable")
+    codes, counts = codes[order], counts[order]
+    if len(codes) == 0:
+        return codes, counts
+    starts = np.flatnonzero(np.diff(codes, prepend=codes[0] ^ 1))
+    return codes[starts], np.add.reduceat(counts, starts)
+
+
+class KmerCounts:
+    # counts of the k-mers of any number of records, a dense 4^k array
+    # when it is small and sorted unique (codes, counts) otherwise; counts
+    # of different records merge by adding up
+    def __init__(self, k, dense=None):
+        assert 1 <= k <= MAX_K
+        self.k = k
+        self.dense = 4**k <= _DENSE_MAX if dense is None else dense
+        if self.dense:
+            self.codes = None
+            self.counts = np.zeros(4**k, dtype=np.int64)
+        else:
+            self.codes = np.zeros(0, dtype=np.uint32)
+            self.counts = np.zeros(0, dtype=np.int64)
+
+    def add(self, seq):
+        return self.update([seq])
+
+    def update(self, seqs):
+        # codes of short records are gathered up to _BUFFER before being
+        # binned, so no record pays for a whole table or sorted merge
+        pending, size = [], 0
+        for seq in seqs:
+            pending.append(kmer_codes(seq, self.k))
+            size += len(pending[-1])
+            if size >= _BUFFER:
+                self.add_codes(np.concatenate(pending))
+                pending, size = [], 0
+        if pending:
+            self.add_codes(np.concatenate(pending))
+        return self
+
+    def add_codes(self, codes):
+        if self.dense:
+            self.counts += np.bincount(codes, minlength=len(self.counts))
+        else:
+            codes, counts = np.unique(codes, return_counts=True)
+            self.add_sparse(codes, counts)
+
+    def add_sparse(self, codes, counts):
+        self.codes, self.counts = sum_sorted(
+            np.concatenate([self.codes, codes]),
+            np.concatenate([self.counts, counts.astype(np.int64)]),
+        )
+
+    def merge(self, other):
+        assert self.k == other.k
+        if self.dense:
+            self.counts += other.to_dense()
+        else:
+            self.add_sparse(other.codes, other.counts)
+        return self
+
+    def to_dense(self):
+        if self.dense:
+            return self.counts
+        res = np.zeros(4**self.k, dtype=np.int64)
+        res[self.codes] = self.counts
+        return res
+
+    def items(self):  # (k-mer, count) of every k-mer seen
+        if self.dense:
+            codes = np.flatnonzero(self.counts)
+            counts = self.counts[codes]
+        else:
+            codes, counts = self.codes, self.counts
+        for code, count in zip(codes, counts):
+            yield decode(code, self.k), int(count)
+
+    def frequencies(self):
+        # the 4^k array of k-mer frequencies when dense, (codes,
+        # frequencies) of the k-mers seen otherwise, so a sparse table is
+        # never expanded to 4^k
+        total = max(self.counts.sum(), 1)
+        if self.dense:
+            return self.counts / total
+        return self.codes, self.counts / total
+
+    def transitions(self, pseudo=0.0):
+        # probabilities of the last base given the first k-1 from the same
+        # counts: a (4^(k-1) x 4) table when dense, contexts never seen
+        # uniform; (contexts, (n x 4) table) of the contexts seen otherwise,
+        # grouped from the sorted codes
+        if self.dense:
+            counts = self.counts.reshape(-1, 4) + pseudo
+            total = counts.sum(axis=1, keepdims=True)
+            with np.errstate(invalid="ignore"):
+                return np.where(total > 0, counts / total, 0.25)
+        contexts = self.codes >> np.uint32(2)
+        if len(contexts) == 0:
+            return contexts, np.zeros((0, 4))
+        starts = np.flatnonzero(np.diff(contexts, prepend=contexts[0] ^ 1))
+        rows = np.repeat(
+            np.arange(len(starts)), np.diff(starts, append=len(contexts))
+        )
+        table = np.full((len(starts), 4), float(pseudo))
+        table[rows, self.codes & 3] += self.counts
+        total = np.add.reduceat(self.counts, starts) + 4 * pseudo
+        return contexts[starts], table / total[:, None]
+
+
+def _count_batch(args):
+    seqs, k = args
+    return KmerCounts(k).update(seqs)
+
+
+def count_kmers(seqs, k, n_jobs=1):
+    # k-mer counts of ASCII uint8 arrays (or strings), batches of them
+    # counted in a process pool when n_jobs > 1
+    seqs = [
+        np.frombuffer(s.encode(), dtype=np.uint8) if isinstance(s, str) else s
+        for s in seqs
+    ]
+    if n_jobs <= 1:
+        return _count_batch((seqs, k))
+    res = KmerCounts(k)
+    batches = [seqs[i :: 4 * n_jobs] for i in range(4 * n_jobs)]
+    with ProcessPoolExecutor(n_jobs) as pool:
+        for counts in pool.map(_count_batch, [(b, k) for b in batches]):
+            res.merge(counts)
+    return res
+
+
+def naive_counts(seqs, k):
+    res = Counter()
+    for s in seqs:
+        for i in range(len(s) - k + 1):
+            if set(s[i : i + k].upper()) <= set("ACGT"):
+                res[s[i : i + k].upper()] += 1
+    return res
+
+
+def test(k, n_jobs=1):
+    rng = np.random.default_rng(k)
+    seqs = [
+        "".join(rng.choice(list("ACGTACGTacgtN"), rng.integers(0, 300)))
+        for _ in range(20)
+    ]
+    counts = count_kmers(seqs, k, n_jobs)
+    assert dict(counts.items()) == naive_counts(seqs, k)
+
+    # dense and sparse counts agree, and so do halves merged together
+    halves = count_kmers(seqs[:7], k).merge(count_kmers(seqs[7:], k))
+    assert dict(halves.items()) == dict(counts.items())
+    if 4**k <= 4 * _DENSE_MAX:
+        other = KmerCounts(k, dense=not counts.dense)
+        for seq in seqs:
+            other.add(np.frombuffer(seq.encode(), dtype=np.uint8))
+        assert dict(other.items()) == dict(counts.items())
+    if not counts.dense:
+        # sparse tables are grouped from the sorted codes and match the
+        # dense ones where k-mers were seen
+        codes, freqs = counts.frequencies()
+        assert np.allclose(freqs * counts.counts.sum(), counts.counts)
+        assert np.isclose(freqs.sum(), 1)
+        contexts, table = counts.transitions(pseudo=0.5)
+        assert np.allclose(table.sum(axis=1), 1)
+        if k <= 8:
+            dense = KmerCounts(k, dense=True).merge(counts)
+            assert np.allclose(dense.frequencies()[codes], freqs)
+            assert np.allclose(dense.transitions(0.5)[contexts], table)
+    if k <= 8 and counts.dense:
+        table = counts.transitions()
+        assert np.allclose(table.sum(axis=1), 1)
+        for kmer, count in counts.items():
+            context = sum(
+                c for key, c in counts.items() if key[:-1] == kmer[:-1]
+            )
+            code = kmer_codes(np.frombuffer(kmer.encode(), np.uint8), k)[0]
+            assert np.isclose(table.ravel()[code], count / context)
+
+
+def test_sparse(k):
+    # the dense and sparse paths of test agree for small k as well
+    global _DENSE_MAX
+    saved, _DENSE_MAX = _DENSE_MAX, 0
+    try:
+        test(k)
+    finally:
+        _DENSE_MAX = saved
+
+
+def main():
+    codes = kmer_codes(np.frombuffer(b"GATTACA", dtype=np.uint8), 7)
+    assert decode(codes[0], 7) == "GATTACA"
+    for k in (1, 2, 3, 5, 12, 16):
+        test(k)
+    for k in (3, 5):
+        test_sparse(k)
+    test(3, n_jobs=2)
+    test(12, n_jobs=2)
+    print("kmer counting test passed")
+
+
+if __name__ == "__main__":
+    main()
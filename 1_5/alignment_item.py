@@ -3,6 +3,8 @@ from enum import Enum
 import numpy as np
 from frozendict import frozendict
 
+from encoding import EncodedSeq, encode
+
 
 class Symbols(Enum):
     A = "A"
@@ -15,6 +17,7 @@ class Symbols(Enum):
 class SymbolsMapping:
     idx_to_char = tuple(c.value for c in Symbols)
     char_to_idx = frozendict({k: i for i, k in enumerate(idx_to_char)})
+    alphabet = "".join(idx_to_char)
 
 
 def symbol_to_profile(c):
@@ -23,41 +26,65 @@ def symbol_to_profile(c):
     return profile
 
 
+_GAP = SymbolsMapping.char_to_idx[Symbols.Gap.value]
+_GAP_PROFILE = symbol_to_profile(Symbols.Gap.value)
+
+
 class AlignmentItem:
-    def __init__(self, seqs, idxs, profile, consensus):
-        self.seqs = seqs
+    # codes is a (sequences x columns) uint8 matrix of symbol indices and
+    # profile a dense (columns x symbols) matrix of symbol frequencies
+    def __init__(self, codes, idxs, profile):
+        self.codes = codes
         self.idxs = idxs
         self.profile = profile
-        self.consensus = consensus
-        self.seqs_length = len(self.seqs[0])
+        self.encoded = EncodedSeq(
+            profile.argmax(axis=1).astype(np.uint8), SymbolsMapping.alphabet
+        )
+
+    @property
+    def seqs_length(self):
+        return self.codes.shape[1]
+
+    @property
+    def consensus(self):
+        return list(self.encoded)
+
+    @property
+    def seqs(self):
+        return [
+            list(EncodedSeq(row, SymbolsMapping.alphabet))
+            for row in self.codes
+        ]
 
     @classmethod
     def from_seq(cls, seq, idx=0):
-        seqs = [list(seq)]
-        profile = [symbol_to_profile(c) for c in seq]
-        consensus = list(seq)
-        return cls(seqs, [idx], profile, consensus)
+        codes = encode(seq, SymbolsMapping.alphabet).codes
+        profile = np.eye(len(Symbols))[codes]
+        return cls(codes[None, :], [idx], profile)
+
+    def take_columns(self, cols):
+        # new item whose columns are cols of this one, -1 is a gap column
+        codes = np.hstack(
+            [self.codes, np.full((len(self.codes), 1), _GAP, np.uint8)]
+        )
+        profile = np.vstack([self.profile, _GAP_PROFILE])
+        return AlignmentItem(codes[:, cols], self.idxs.copy(), profile[cols])
 
     def merge(self, other):
         assert self.seqs_length == other.seqs_length
-        n1, n2 = len(self.seqs), len(other.seqs)
+        n1, n2 = len(self.codes), len(other.codes)
         nn = n1 + n2
-        self.profile = [
-            (p1 * n1 + p2 * n2) / nn
-            for p1, p2 in zip(self.profile, other.profile)
-        ]
-        self.seqs.extend(other.seqs)
+        self.profile = (self.profile * n1 + other.profile * n2) / nn
+        self.codes = np.vstack([self.codes, other.codes])
         self.idxs.extend(other.idxs)
-        self.consensus = [
-            SymbolsMapping.idx_to_char[p.argmax()] for p in self.profile
-        ]
+        self.encoded = EncodedSeq(
+            self.profile.argmax(axis=1).astype(np.uint8),
+            SymbolsMapping.alphabet,
+        )
 
     def reorder_seqs(self):
-        seqs = [0] * len(self.idxs)
-        for i, seq in zip(self.idxs, self.seqs):
-            seqs[i] = seq
-        self.seqs = seqs
-        self.idxs = [i for i in range(len(self.seqs))]
+        self.codes = self.codes[np.argsort(self.idxs)]
+        self.idxs = [i for i in range(len(self.codes))]
 
     def __repr__(self):
         return repr(self.seqs)
@@ -1,4 +1,10 @@
-from msa import multiple_sequence_alignment
+import random
+
+import numpy as np
+
+from alignment_item import AlignmentItem
+from msa import MergeQueue, make_score_matrix, multiple_sequence_alignment
+from needleman_wunsch import needleman_wunsch, needleman_wunsch_score_only
 
 
 def print_alignment(alignment):
@@ -6,9 +12,9 @@ def print_alignment(alignment):
         print("".join(a))
 
 
-def test(seqs, del_cost, ins_cost, match_cost, mismatch_cost):
+def test(seqs, del_cost, ins_cost, match_cost, mismatch_cost, **kwargs):
     score, alignment = multiple_sequence_alignment(
-        seqs, del_cost, ins_cost, match_cost, mismatch_cost
+        seqs, del_cost, ins_cost, match_cost, mismatch_cost, **kwargs
     )
     print("-" * 50)
     print(score)
@@ -16,6 +22,91 @@ def test(seqs, del_cost, ins_cost, match_cost, mismatch_cost):
     print("-" * 50)
 
 
+def test_parallel_scores(seqs, *costs):
+    profiles = [AlignmentItem.from_seq(s, i) for i, s in enumerate(seqs)]
+    expected = make_score_matrix(profiles, *costs)
+    scores = make_score_matrix(profiles, *costs, n_jobs=2)
+    assert np.array_equal(expected, scores, equal_nan=True)
+
+
+def test_kmer_guide_tree(seqs, *costs):
+    _, alignment = multiple_sequence_alignment(
+        seqs, *costs, guide_tree="kmer", k=3
+    )
+    assert len(set(map(len, alignment))) == 1
+    for seq, row in zip(seqs, alignment):
+        assert "".join(row).replace("-", "") == seq
+
+
+def test_profile_alignment(seqs, *costs):
+    s, t = (AlignmentItem.from_seq(x) for x in seqs[:2])
+    score, merged = needleman_wunsch(s, t, *costs, profile=True)
+    assert score == needleman_wunsch(s, t, *costs)[0]
+    u = AlignmentItem.from_seq(seqs[2])
+    assert np.isclose(
+        needleman_wunsch(merged, u, *costs, profile=True)[0],
+        needleman_wunsch_score_only(merged, u, *costs, profile=True),
+    )
+    for guide_tree in ("dp", "kmer"):
+        _, alignment = multiple_sequence_alignment(
+            seqs, *costs, guide_tree=guide_tree, profile=True
+        )
+        assert len(set(map(len, alignment))) == 1
+        for seq, row in zip(seqs, alignment):
+            assert "".join(row).replace("-", "") == seq
+
+
+def test_linear_memory(seqs, *costs):
+    s, t, u = (AlignmentItem.from_seq(x, i) for i, x in enumerate(seqs[:3]))
+    for profile in (False, True):
+        merged = needleman_wunsch(s, t, *costs, profile=profile)[1]
+        full, expected = needleman_wunsch(merged, u, *costs, profile=profile)
+        score, res = needleman_wunsch(
+            merged, u, *costs, profile=profile, linear_memory_cells=0
+        )
+        assert np.isclose(score, full)
+        assert res.codes.shape[0] == expected.codes.shape[0]
+        res.reorder_seqs()
+        for seq, row in zip(seqs, res.seqs):
+            assert "".join(row).replace("-", "") == seq
+    _, alignment = multiple_sequence_alignment(
+        seqs, *costs, profile=True, linear_memory_cells=0
+    )
+    for seq, row in zip(seqs, alignment):
+        assert "".join(row).replace("-", "") == seq
+
+
+def test_merge_queue(n):
+    # against a row-major argmax over the NaN-masked upper triangle
+    scores = np.random.randint(0, 5, (n, n)).astype(np.float64)
+    scores = np.minimum(scores, scores.T)
+    scores[np.diag_indices(n)] = np.nan
+    queue = MergeQueue(scores)
+    for _ in range(n - 1):
+        idx = np.nanargmax(np.where(np.tri(n, dtype=bool), np.nan, scores))
+        i, j = divmod(idx, n)
+        assert queue.pop() == (i, j)
+        others = queue.others(i, j)
+        values = np.random.randint(0, 5, len(others))
+        queue.update(i, j, others, values)
+        scores[j] = scores[:, j] = np.nan
+        scores[i, others] = scores[others, i] = values
+
+
+def mutate(seq, rate=0.1):
+    res = []
+    for c in seq:
+        r = random.random()
+        if r < rate / 2:
+            continue
+        res.append(random.choice("ACGT") if r < rate else c)
+    return "".join(res) or seq
+
+
+def random_dna(length):
+    return "".join(random.choices(("A", "G", "T", "C"), k=length))
+
+
 def main():
     del_cost = -2
     ins_cost = -2
@@ -31,6 +122,25 @@ def main():
     test(["ACTA", "ACGTA"], *costs)
     test(["CTGA", "CATA", "ATGA", "ATAA"], *costs)
 
+    seqs = [random_dna(random.randrange(1, 50)) for _ in range(20)]
+    test_parallel_scores(seqs, *costs)
+    print("parallel score matrix test passed")
+
+    for n in (2, 5, 50):
+        test_merge_queue(n)
+    print("merge queue test passed")
+
+    ancestor = random_dna(60)
+    test_kmer_guide_tree([mutate(ancestor) for _ in range(30)], *costs)
+    print("k-mer guide tree test passed")
+
+    test_profile_alignment([mutate(ancestor) for _ in range(15)], *costs)
+    print("profile alignment test passed")
+
+    ancestor = random_dna(400)
+    test_linear_memory([mutate(ancestor) for _ in range(6)], *costs)
+    print("linear memory alignment test passed")
+
 
 if __name__ == "__main__":
     main()
@@ -1,12 +1,91 @@
+import heapq
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
 import numpy as np
 
 from alignment_item import AlignmentItem
-from needleman_wunsch import needleman_wunsch, needleman_wunsch_score_only
+from needleman_wunsch import (
+    _LINEAR_MEMORY_CELLS,
+    needleman_wunsch,
+    needleman_wunsch_score_only,
+    score_matrix,
+    score_only,
+)
+
+_worker_state = None
+
+
+def _init_worker(codes, costs, shm_name):
+    global _worker_state
+    del_cost, ins_cost, match_cost, mismatch_cost = costs
+    scores = score_matrix(del_cost, ins_cost, match_cost, mismatch_cost)
+    shm = shared_memory.SharedMemory(shm_name)
+    n = len(codes)
+    out = np.ndarray((n, n), dtype=np.float64, buffer=shm.buf)
+    _worker_state = codes, scores, del_cost, ins_cost, shm, out
+
+
+def _score_tile(pairs):
+    codes, scores, del_cost, ins_cost, _, out = _worker_state
+    start = time.perf_counter()
+    for i, j in pairs:
+        out[i, j] = out[j, i] = score_only(
+            codes[i], codes[j], scores, del_cost, ins_cost
+        )
+    return len(pairs), time.perf_counter() - start
+
+
+def make_score_matrix_parallel(
+    align_profiles, costs, n_jobs, tiles_per_job=4, verbose=False
+):
+    # pairs are split into tiles scored in a process pool; every worker
+    # gets the encoded consensus sequences once and writes its scores
+    # into the shared matrix
+    n = len(align_profiles)
+    codes = [p.encoded.codes for p in align_profiles]
+    pairs = np.stack(np.triu_indices(n, 1), axis=1)
+    tiles = np.array_split(pairs, max(1, n_jobs * tiles_per_job))
+    shm = shared_memory.SharedMemory(create=True, size=max(1, n * n * 8))
+    try:
+        scores = np.ndarray((n, n), dtype=np.float64, buffer=shm.buf)
+        scores.fill(0)
+        start = time.perf_counter()
+        with ProcessPoolExecutor(
+            n_jobs, initializer=_init_worker, initargs=(codes, costs, shm.name)
+        ) as pool:
+            futures = [pool.submit(_score_tile, tile) for tile in tiles]
+            for done, future in enumerate(as_completed(futures), 1):
+                n_pairs, elapsed = future.result()
+                if verbose:
+                    print(
+                        f"tile {done}/{len(tiles)}: {n_pairs} pairs",
+                        f"in {elapsed:.2f}s,",
+                        f"total {time.perf_counter() - start:.2f}s",
+                    )
+        res = scores.copy()
+    finally:
+        shm.close()
+        shm.unlink()
+    res[np.diag_indices(n)] = np.nan
+    return res
 
 
 def make_score_matrix(
-    align_profiles, del_cost, ins_cost, match_cost, mismatch_cost
+    align_profiles,
+    del_cost,
+    ins_cost,
+    match_cost,
+    mismatch_cost,
+    n_jobs=1,
+    verbose=False,
 ):
+    if n_jobs > 1:
+        costs = (del_cost, ins_cost, match_cost, mismatch_cost)
+        return make_score_matrix_parallel(
+            align_profiles, costs, n_jobs, verbose=verbose
+        )
     n = len(align_profiles)
     scores = np.zeros((n, n))
     for i in range(n):
@@ -23,27 +102,150 @@ def make_score_matrix(
     return scores
 
 
-def nanargmax2d(x):
-    n = x.shape[0]
-    idx = np.nanargmax(x)
-    i = idx // n
-    j = idx - i * n
-    assert i < j
-    return i, j
+def kmer_counts(align_profiles, k):
+    # (sequences x 4^k) k-mer counts over ACGT, built for all sequences at
+    # once from one concatenated code array
+    codes = [p.encoded.codes for p in align_profiles]
+    lengths = np.array([len(c) for c in codes])
+    flat = np.concatenate(codes).astype(np.int64)
+    owner = np.repeat(np.arange(len(codes)), lengths)
+    n_kmers = max(len(flat) - k + 1, 0)
+    kmers = np.zeros(n_kmers, dtype=np.int64)
+    valid = np.ones(n_kmers, dtype=bool)
+    for shift in range(k):
+        part = flat[shift : shift + n_kmers]
+        kmers = kmers * 4 + np.minimum(part, 3)
+        valid &= (part < 4) & (
+            owner[shift : shift + n_kmers] == owner[:n_kmers]
+        )
+    counts = np.bincount(
+        owner[:n_kmers][valid] * 4**k + kmers[valid],
+        minlength=len(codes) * 4**k,
+    )
+    return counts.reshape(len(codes), 4**k), lengths
+
+
+def kmer_similarity(align_profiles, k):
+    # minus the k-mer distance used by MUSCLE and Clustal Omega for their
+    # guide trees: 1 - shared k-mers / k-mers of the shorter sequence
+    counts, lengths = kmer_counts(align_profiles, k)
+    n = len(counts)
+    shared = np.empty((n, n))
+    for i in range(n):
+        shared[i] = np.minimum(counts[i], counts).sum(axis=1)
+    denom = np.minimum.outer(lengths, lengths) - k + 1
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dist = np.where(denom > 0, 1 - shared / denom, 1.0)
+    res = -dist
+    res[np.diag_indices(n)] = np.nan
+    return res
+
+
+class MergeQueue:
+    # picks the best pair of active clusters of a symmetric score matrix
+    # in the same order as a row-major argmax over its upper triangle:
+    # every row caches its best partner to the right, a heap holds the
+    # cached bests and entries that went stale are dropped when popped
+    def __init__(self, scores):
+        n = len(scores)
+        self.scores = np.where(np.isnan(scores), -np.inf, scores)
+        self.active = np.ones(n, dtype=bool)
+        self.best = np.full(n, -1)
+        self.best_score = np.full(n, -np.inf)
+        self.heap = []
+        for i in range(n):
+            self.rescan(i)
+
+    def push(self, i, j, score):
+        self.best[i] = j
+        self.best_score[i] = score
+        heapq.heappush(self.heap, (-score, i, j))
+
+    def rescan(self, i):
+        row = np.where(self.active[i + 1 :], self.scores[i, i + 1 :], -np.inf)
+        j = int(row.argmax()) if len(row) else 0
+        if len(row) == 0 or row[j] == -np.inf:
+            self.best[i] = -1
+            self.best_score[i] = -np.inf
+        else:
+            self.push(i, i + 1 + j, row[j])
+
+    def pop(self):
+        while self.heap:
+            score, i, j = heapq.heappop(self.heap)
+            if (
+                self.active[i]
+                and self.best[i] == j
+                and self.best_score[i] == -score
+            ):
+                return i, j
+        raise IndexError("no pair of active clusters left")
+
+    def others(self, i, j):  # active clusters except i and j
+        active = self.active.copy()
+        active[[i, j]] = False
+        return np.flatnonzero(active)
+
+    def update(self, i, j, others, values):
+        # cluster j joined cluster i, whose scores against others (every
+        # other active cluster) are now values
+        self.active[j] = False
+        self.scores[i, others] = self.scores[others, i] = values
+        self.rescan(i)
+
+        # rows left of i see a new column i, any row may lose column j
+        best = self.best[others]
+        new = self.scores[others, i]
+        stale = (best == j) | ((others < i) & (best == i))
+        better = (others < i) & (
+            (new > self.best_score[others])
+            | ((new == self.best_score[others]) & (i < best))
+        )
+        for k in others[stale]:
+            self.rescan(k)
+        for k, score in zip(others[better & ~stale], new[better & ~stale]):
+            self.push(k, i, score)
 
 
 def multiple_sequence_alignment(
-    seqs, del_cost, ins_cost, match_cost, mismatch_cost
+    seqs,
+    del_cost,
+    ins_cost,
+    match_cost,
+    mismatch_cost,
+    n_jobs=1,
+    guide_tree="dp",
+    k=4,
+    profile=False,
+    linear_memory_cells=_LINEAR_MEMORY_CELLS,
+    verbose=False,
 ):
+    # guide_tree="dp" picks every merge by full Needleman-Wunsch scores,
+    # "kmer" builds a UPGMA tree from alignment-free k-mer distances;
+    # profile=True aligns clusters by their frequency profiles and merges
+    # over linear_memory_cells DP cells run in linear memory; verbose
+    # reports the tiles of the score matrix scored in n_jobs processes
+    assert guide_tree in ("dp", "kmer")
     n = len(seqs)
     align_profiles = [
         AlignmentItem.from_seq(seq, i) for i, seq in enumerate(seqs)
     ]
-    scores = make_score_matrix(
-        align_profiles, del_cost, ins_cost, match_cost, mismatch_cost
-    )
-    for i in range(n - 2):
-        i, j = nanargmax2d(scores)
+    if guide_tree == "kmer":
+        scores = kmer_similarity(align_profiles, k)
+    else:
+        scores = make_score_matrix(
+            align_profiles,
+            del_cost,
+            ins_cost,
+            match_cost,
+            mismatch_cost,
+            n_jobs,
+            verbose,
+        )
+    queue = MergeQueue(scores)
+    sizes = np.ones(n)
+    for step in range(n - 1):
+        i, j = queue.pop()
         score, align_profiles[i] = needleman_wunsch(
             align_profiles[i],
             align_profiles[j],
@@ -51,31 +253,37 @@ def multiple_sequence_alignment(
             ins_cost,
             match_cost,
             mismatch_cost,
+            profile,
+            linear_memory_cells,
         )
-        scores[..., j] = scores[j, ...] = np.nan
+        align_profiles[j] = None
+        if step == n - 2:
+            break
 
-        for j in range(n):
-            if not np.isnan(scores[i, j]):
-                scores[i, j] = scores[j, i] = needleman_wunsch_score_only(
+        others = queue.others(i, j)
+        if guide_tree == "kmer":
+            values = (
+                sizes[i] * queue.scores[i, others]
+                + sizes[j] * queue.scores[j, others]
+            ) / (sizes[i] + sizes[j])
+            sizes[i] += sizes[j]
+        else:
+            values = [
+                needleman_wunsch_score_only(
                     align_profiles[i],
-                    align_profiles[j],
+                    align_profiles[other],
                     del_cost,
                     ins_cost,
                     match_cost,
                     mismatch_cost,
+                    profile,
                 )
-
-    i, j = nanargmax2d(scores)
-    ans_score, ans_alignment = needleman_wunsch(
-        align_profiles[i],
-        align_profiles[j],
-        del_cost,
-        ins_cost,
-        match_cost,
-        mismatch_cost,
-    )
+                for other in others
+            ]
+        queue.update(i, j, others, values)
 
     # reorder as in input
+    ans_alignment = align_profiles[i]
     ans_alignment.reorder_seqs()
 
-    return ans_score, ans_alignment.seqs
+    return score, ans_alignment.seqs
@@ -1,90 +1,151 @@
 import numpy as np
 
-from alignment_item import Symbols, symbol_to_profile, AlignmentItem
+from alignment_item import Symbols, SymbolsMapping
 
-
-def scorer(del_cost, ins_cost, match_cost, mismatch_cost):
-    def inner(a, b):
-        if a == Symbols.Gap.value:
-            return ins_cost
-        elif b == Symbols.Gap.value:
-            return del_cost
-        elif a == b:
-            return match_cost
-        else:
-            return mismatch_cost
-
-    return inner
-
-
-def append_symbol(i, consensus, seqs, profile, align_profile):
-    consensus.append(align_profile.consensus[i])
-    for j in range(len(align_profile.seqs)):
-        seqs[j].append(align_profile.seqs[j][i])
-    profile.append(align_profile.profile[i])
+_TOLERANCE = 1e-9  # profile scores are fractional, so compare with slack
+_BLOCK_CELLS = 1 << 20  # grid cells materialized at once
+_BASE_CELLS = 1 << 14  # Hirschberg subproblems solved by a full DP
+_LINEAR_MEMORY_CELLS = 1 << 24  # larger merges switch to Hirschberg
 
 
-def append_gap(consensus, seqs, profile):
-    consensus.append(Symbols.Gap.value)
-    for j in range(len(seqs)):
-        seqs[j].append(Symbols.Gap.value)
-    profile.append(symbol_to_profile(Symbols.Gap.value))
-
-
-def reverse_alignment(consensus, seqs, profile):
-    consensus.reverse()
-    for i in range(len(seqs)):
-        seqs[i].reverse()
-    profile.reverse()
+def gap_score_matrix(
+    alphabet, gap, del_cost, ins_cost, match_cost, mismatch_cost
+):
+    k = alphabet.index(gap)
+    dtype = np.result_type(del_cost, ins_cost, match_cost, mismatch_cost)
+    scores = np.full(
+        (len(alphabet), len(alphabet)), mismatch_cost, dtype=dtype
+    )
+    np.fill_diagonal(scores, match_cost)
+    scores[..., k] = del_cost
+    scores[k, ...] = ins_cost
+    return scores
+
+
+def score_matrix(del_cost, ins_cost, match_cost, mismatch_cost):
+    return gap_score_matrix(
+        SymbolsMapping.alphabet,
+        Symbols.Gap.value,
+        del_cost,
+        ins_cost,
+        match_cost,
+        mismatch_cost,
+    )
 
 
-def restore_alignment(
-    s_align_profile, t_align_profile, res, del_cost, ins_cost, score_fn
-):
-    s = s_align_profile.consensus
-    t = t_align_profile.consensus
-    n, m = len(s), len(t)
+def column_factors(s_align_profile, t_align_profile, scores, profile=False):
+    # left @ right.T is the grid of column-pair scores: with profile the
+    # expected score of two frequency columns P_s @ S @ P_t.T, otherwise
+    # the score of the consensus symbols (a one-hot right factor)
+    if profile:
+        return s_align_profile.profile @ scores, t_align_profile.profile
+    one_hot = np.eye(len(scores))
+    return (
+        scores[s_align_profile.encoded.codes].astype(np.float64),
+        one_hot[t_align_profile.encoded.codes],
+    )
 
-    s_consensus = []
-    s_profile = []
-    s_seqs = [[] for _ in range(len(s_align_profile.seqs))]
-    t_consensus = []
-    t_profile = []
-    t_seqs = [[] for _ in range(len(t_align_profile.seqs))]
 
+def dp_rows(left, right, del_cost, ins_cost):
+    # rows of the DP over the grid left @ right.T, one vectorized row at a
+    # time; the grid is built a block of rows at a time and insertions
+    # within a row are a running max
+    n, m = len(left), len(right)
+    steps = np.arange(m + 1) * ins_cost
+    row = steps.astype(np.float64)
+    yield row
+    x = np.empty(m + 1)
+    block = max(1, _BLOCK_CELLS // max(m, 1))
+    for lo in range(0, n, block):
+        grid = left[lo : lo + block] @ right.T
+        for i, pair in enumerate(grid, lo):
+            x[0] = (i + 1) * del_cost
+            np.maximum(row[:-1] + pair, row[1:] + del_cost, out=x[1:])
+            row = np.maximum.accumulate(x - steps) + steps
+            yield row
+
+
+def last_row(left, right, del_cost, ins_cost):
+    for row in dp_rows(left, right, del_cost, ins_cost):
+        pass
+    return row
+
+
+def same(a, b):
+    return abs(a - b) <= _TOLERANCE * max(1.0, abs(a))
+
+
+def traceback(left, right, res, del_cost, ins_cost):
+    # column operations of the merged alignment: the source columns of s
+    # and t for every merged column, -1 where that side gets a gap; only
+    # the column pairs on the path are scored again
+    n, m = len(left), len(right)
+    s_cols, t_cols = [], []
     i, j = n - 1, m - 1
     while i >= 0 and j >= 0:
-        if res[i + 1, j + 1] == res[i, j + 1] + del_cost:
-            append_symbol(i, s_consensus, s_seqs, s_profile, s_align_profile)
-            append_gap(t_consensus, t_seqs, t_profile)
+        if same(res[i + 1, j + 1], res[i, j + 1] + del_cost):
+            s_cols.append(i)
+            t_cols.append(-1)
             i -= 1
-        elif res[i + 1, j + 1] == res[i + 1, j] + ins_cost:
-            append_gap(s_consensus, s_seqs, s_profile)
-            append_symbol(j, t_consensus, t_seqs, t_profile, t_align_profile)
+        elif same(res[i + 1, j + 1], res[i + 1, j] + ins_cost):
+            s_cols.append(-1)
+            t_cols.append(j)
             j -= 1
-        elif res[i + 1, j + 1] == res[i, j] + score_fn(s[i], t[j]):
-            append_symbol(i, s_consensus, s_seqs, s_profile, s_align_profile)
-            append_symbol(j, t_consensus, t_seqs, t_profile, t_align_profile)
+        else:
+            assert same(res[i + 1, j + 1], res[i, j] + left[i] @ right[j])
+            s_cols.append(i)
+            t_cols.append(j)
             i -= 1
             j -= 1
-    while i >= 0:
-        append_symbol(i, s_consensus, s_seqs, s_profile, s_align_profile)
-        append_gap(t_consensus, t_seqs, t_profile)
-        i -= 1
-    while j >= 0:
-        append_gap(s_consensus, s_seqs, s_profile)
-        append_symbol(j, t_consensus, t_seqs, t_profile, t_align_profile)
-        j -= 1
-
-    reverse_alignment(s_consensus, s_seqs, s_profile)
-    reverse_alignment(t_consensus, t_seqs, t_profile)
-    s_idxs = s_align_profile.idxs.copy()
-    t_idxs = t_align_profile.idxs.copy()
-    new_alignment = AlignmentItem(s_seqs, s_idxs, s_profile, s_consensus)
-    new_alignment.merge(AlignmentItem(t_seqs, t_idxs, t_profile, t_consensus))
+    s_cols.extend(range(i, -1, -1))
+    t_cols.extend([-1] * (i + 1))
+    s_cols.extend([-1] * (j + 1))
+    t_cols.extend(range(j, -1, -1))
+    s_cols.reverse()
+    t_cols.reverse()
+    return np.array(s_cols, dtype=np.intp), np.array(t_cols, dtype=np.intp)
+
+
+def apply_columns(s_align_profile, t_align_profile, s_cols, t_cols):
+    new_alignment = s_align_profile.take_columns(s_cols)
+    new_alignment.merge(t_align_profile.take_columns(t_cols))
     return new_alignment
 
 
+def full_dp(left, right, del_cost, ins_cost):
+    # the DP matrix is the only (n + 1) x (m + 1) array, filled in place
+    res = np.empty((len(left) + 1, len(right) + 1))
+    for i, row in enumerate(dp_rows(left, right, del_cost, ins_cost)):
+        res[i] = row
+    s_cols, t_cols = traceback(left, right, res, del_cost, ins_cost)
+    return res[-1, -1], s_cols, t_cols
+
+
+def hirschberg(left, right, del_cost, ins_cost):
+    # same column operations in O(n + m) memory: split s in half, pick the
+    # column of t where the forward and reverse last rows sum to the best
+    # score and solve both halves independently
+    n, m = len(left), len(right)
+    if n <= 1 or n * m <= _BASE_CELLS:
+        return full_dp(left, right, del_cost, ins_cost)
+    mid = n // 2
+    forward = last_row(left[:mid], right, del_cost, ins_cost)
+    reverse = last_row(left[mid:][::-1], right[::-1], del_cost, ins_cost)
+    total = forward + reverse[::-1]
+    j = int(total.argmax())
+    _, s_top, t_top = hirschberg(left[:mid], right[:j], del_cost, ins_cost)
+    _, s_bottom, t_bottom = hirschberg(
+        left[mid:], right[j:], del_cost, ins_cost
+    )
+    s_bottom[s_bottom >= 0] += mid
+    t_bottom[t_bottom >= 0] += j
+    return (
+        total[j],
+        np.concatenate([s_top, s_bottom]),
+        np.concatenate([t_top, t_bottom]),
+    )
+
+
 def needleman_wunsch(
     s_align_profile,
     t_align_profile,
@@ -92,28 +153,41 @@ def needleman_wunsch(
     ins_cost,
     match_cost,
     mismatch_cost,
+    profile=False,
+    linear_memory_cells=_LINEAR_MEMORY_CELLS,
 ):
-    s = s_align_profile.consensus
-    t = t_align_profile.consensus
-    score_fn = scorer(del_cost, ins_cost, match_cost, mismatch_cost)
-    n, m = len(s), len(t)
+    # profile=True aligns the frequency profiles instead of the consensus;
+    # merges over linear_memory_cells DP cells use Hirschberg's algorithm
+    scores = score_matrix(del_cost, ins_cost, match_cost, mismatch_cost)
+    left, right = column_factors(
+        s_align_profile, t_align_profile, scores, profile
+    )
+    if len(left) * len(right) > linear_memory_cells:
+        score, s_cols, t_cols = hirschberg(left, right, del_cost, ins_cost)
+    else:
+        score, s_cols, t_cols = full_dp(left, right, del_cost, ins_cost)
+    new_alignment = apply_columns(
+        s_align_profile, t_align_profile, s_cols, t_cols
+    )
+    return score, new_alignment
 
-    res = np.zeros((n + 1, m + 1))
-    res[..., 0] = np.arange(n + 1) * del_cost
-    res[0, ...] = np.arange(m + 1) * ins_cost
 
+def score_only(s, t, scores, del_cost, ins_cost):
+    # last cell of the DP for code arrays s and t, one vectorized row per
+    # symbol of the longer one; insertions within a row are a running max
+    n, m = len(s), len(t)
+    if n < m:
+        n, m = m, n
+        s, t = t, s
+
+    steps = np.arange(m + 1) * ins_cost
+    row = steps.astype(np.float64)
+    x = np.empty(m + 1)
     for i in range(n):
-        for j in range(m):
-            res[i + 1, j + 1] = max(
-                res[i][j] + score_fn(s[i], t[j]),
-                res[i + 1][j] + ins_cost,
-                res[i][j + 1] + del_cost,
-            )
-
-    new_alignment = restore_alignment(
-        s_align_profile, t_align_profile, res, del_cost, ins_cost, score_fn
-    )
-    return res[n][m], new_alignment
+        x[0] = (i + 1) * del_cost
+        np.maximum(row[:-1] + scores[s[i]][t], row[1:] + del_cost, out=x[1:])
+        row = np.maximum.accumulate(x - steps) + steps
+    return row[m]
 
 
 def needleman_wunsch_score_only(
@@ -123,28 +197,18 @@ def needleman_wunsch_score_only(
     ins_cost,
     match_cost,
     mismatch_cost,
+    profile=False,
 ):
-    s = s_align_profile.consensus
-    t = t_align_profile.consensus
-    score_fn = scorer(del_cost, ins_cost, match_cost, mismatch_cost)
-    n, m = len(s), len(t)
-
-    if n < m:
-        n, m = m, n
-        s, t = t, s
-
-    res = np.zeros((2, m + 1))
-    res[0, ...] = np.arange(m + 1) * ins_cost
-
-    k = 0
-    for i in range(n):
-        k ^= 1
-        res[k, 0] = (i + 1) * del_cost
-        for j in range(m):
-            res[k, j + 1] = max(
-                res[k ^ 1][j] + score_fn(s[i], t[j]),
-                res[k][j] + ins_cost,
-                res[k ^ 1][j + 1] + del_cost,
-            )
-
-    return res[k][m]
+    scores = score_matrix(del_cost, ins_cost, match_cost, mismatch_cost)
+    if not profile:
+        return score_only(
+            s_align_profile.encoded.codes,
+            t_align_profile.encoded.codes,
+            scores,
+            del_cost,
+            ins_cost,
+        )
+    left, right = column_factors(
+        s_align_profile, t_align_profile, scores, profile
+    )
+    return last_row(left, right, del_cost, ins_cost)[-1]
@@ -1,32 +1,30 @@
 import sys
 
-input = sys.stdin.readline
+from hmm_model import (
+    HMMModel,
+    format_prob,
+    get_model,
+    parse_args,
+    read_sections,
+)
 
 
 def read():
-    seq = input().strip()
-
-    input()
-    states = input().split()
-    input()
-    input()
-
-    transition_matrix = dict()
-
-    for s1 in states:
-        line = input().split()
-        for s2, p in zip(states, map(float, line[1:])):
-            transition_matrix[(s1, s2)] = p
-
-    return seq, states, transition_matrix
+    seq, states, transition = read_sections(sys.stdin.read())[:3]
+    return seq[0].strip(), states[0].split(), transition
 
 
 def main():
-    seq, states, transition_matrix = read()
-    ans = 1 / len(states)
-    for i in range(len(seq) - 1):
-        ans *= transition_matrix[(seq[i], seq[i + 1])]
-    print(ans)
+    args = parse_args("probability of a hidden path")
+    seq, states, transition = read()
+    model = get_model(
+        args,
+        states,
+        None,
+        lambda: HMMModel.from_sections(states, transition=transition),
+        ("log_transition",),
+    )
+    print(format_prob(model.path_log_prob(seq)))
 
 
 if __name__ == "__main__":
@@ -1,38 +1,36 @@
 import sys
 
-input = sys.stdin.readline
+from hmm_model import (
+    HMMModel,
+    format_prob,
+    get_model,
+    parse_args,
+    read_sections,
+)
 
 
 def read():
-    x = input().strip()
-
-    input()
-    x_states = input().split()
-    input()
-
-    pi = input().strip()
-    input()
-    pi_states = input().split()
-    input()
-
-    input()
-
-    emission_matrix = dict()
-
-    for s1 in pi_states:
-        line = input().split()
-        for s2, x in zip(x_states, map(float, line[1:])):
-            emission_matrix[(s1, s2)] = x
-
-    return x, pi, emission_matrix
+    x, x_states, pi, pi_states, emission = read_sections(sys.stdin.read())[:5]
+    return (
+        x[0].strip(),
+        x_states[0].split(),
+        pi[0].strip(),
+        pi_states[0].split(),
+        emission,
+    )
 
 
 def main():
-    x, pi, emission_matrix = read()
-    ans = 1
-    for e_x, e_pi in zip(x, pi):
-        ans *= emission_matrix[(e_pi, e_x)]
-    print(ans)
+    args = parse_args("probability of an outcome given a hidden path")
+    x, x_states, pi, pi_states, emission = read()
+    model = get_model(
+        args,
+        pi_states,
+        x_states,
+        lambda: HMMModel.from_sections(pi_states, x_states, emission=emission),
+        ("log_emission",),
+    )
+    print(format_prob(model.emission_log_prob(x, pi)))
 
 
 if __name__ == "__main__":
@@ -1,87 +1,73 @@
 import sys
 
 import numpy as np
-from numpy.core.numeric import Infinity
 
-input = sys.stdin.readline
-
-
-def map_dict(d, f):
-    return dict((k, f(v)) for k, v in d.items())
-
-
-def viterbi(x, pi_states, transition_matrix, emission_matrix):
-
-    n = len(x)
-    m = len(pi_states)
-
-    log_emission_matrix = map_dict(emission_matrix, np.log)
-    log_transition_matrix = map_dict(transition_matrix, np.log)
-
-    dp = np.zeros((n, m))
-    logm = np.log(m)
-    for i in range(m):
-        dp[0, i] = -logm + log_emission_matrix[(pi_states[i], x[0])]
-
-    for i in range(1, n):
-        for j, cur_state in enumerate(pi_states):
-            dp[i][j] = -Infinity
-            for k, prev_state in enumerate(pi_states):
-                dp[i][j] = max(
-                    dp[i][j],
-                    dp[i - 1][k]
-                    + log_transition_matrix[(prev_state, cur_state)]
-                    + log_emission_matrix[(cur_state, x[i])],
-                )
-
-    states = [pi_states[np.argmax(dp[n - 1])]]
-    for i in range(n - 2, -1, -1):
-        cur_state = states[-1]
-        k = np.argmax(
-            [
-                dp[i, k]
-                + log_transition_matrix[(prev_state, cur_state)]
-                + log_emission_matrix[(cur_state, x[i + 1])]
-                for k, prev_state in enumerate(pi_states)
-            ]
-        )
-        states.append(pi_states[k])
-    return "".join(reversed(states))
+from hmm_model import HMMModel, get_model, parse_args, read_sections
+
+_CHUNK = 1 << 16  # positions whose emission scores are gathered at once
+
+
+def viterbi_path(codes, log_start, log_transition, log_emission):
+    # most probable state indices for symbol codes; every step is one
+    # broadcasted (m x m) max over the previous scores, only the
+    # backpointers are kept for all positions
+    n, m = len(codes), len(log_start)
+    back = np.zeros((n, m), dtype=np.int8 if m < 128 else np.int16)
+    if n == 0:
+        return back[:, 0]
+    cols = np.arange(m)
+    scores = np.empty((m, m))
+    cur = log_start + log_emission[:, codes[0]]
+    for lo in range(0, n, _CHUNK):
+        emissions = log_emission.T[codes[lo : lo + _CHUNK]]
+        for i in range(max(lo, 1), min(lo + _CHUNK, n)):
+            np.add(cur[:, None], log_transition, out=scores)
+            best = scores.argmax(axis=0)
+            back[i] = best
+            cur = scores[best, cols] + emissions[i - lo]
+
+    path = np.empty(n, dtype=back.dtype)
+    path[-1] = cur.argmax()
+    for i in range(n - 1, 0, -1):
+        path[i - 1] = back[i, path[i]]
+    return path
+
+
+def viterbi(x, model):
+    path = viterbi_path(
+        model.encode_symbols(x),
+        model.log_start,
+        model.log_transition,
+        model.log_emission,
+    )
+    return "".join(np.array(model.states)[path])
 
 
 def read():
-    x = input().strip()
-    input()
-
-    x_states = input().split()
-    input()
-
-    pi_states = input().split()
-    input()
-
-    transition_matrix = dict()
-
-    input()
-    for s1 in pi_states:
-        line = input().split()
-        for s2, p in zip(pi_states, map(float, line[1:])):
-            transition_matrix[(s1, s2)] = p
-    input()
-
-    emission_matrix = dict()
-
-    input()
-    for s1 in pi_states:
-        line = input().split()
-        for s2, p in zip(x_states, map(float, line[1:])):
-            emission_matrix[(s1, s2)] = p
-
-    return x, x_states, pi_states, transition_matrix, emission_matrix
+    sections = read_sections(sys.stdin.read())
+    x, x_states, pi_states, transition, emission = sections[:5]
+    return (
+        x[0].strip(),
+        x_states[0].split(),
+        pi_states[0].split(),
+        transition,
+        emission,
+    )
 
 
 def main():
-    x, _, pi_states, transition_matrix, emission_matrix = read()
-    print(viterbi(x, pi_states, transition_matrix, emission_matrix))
+    args = parse_args("most probable hidden path (Viterbi)")
+    x, x_states, pi_states, transition, emission = read()
+    model = get_model(
+        args,
+        pi_states,
+        x_states,
+        lambda: HMMModel.from_sections(
+            pi_states, x_states, transition, emission
+        ),
+        ("log_transition", "log_emission"),
+    )
+    print(viterbi(x, model))
 
 
 if __name__ == "__main__":
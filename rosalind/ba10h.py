@@ -1,7 +1,11 @@
 import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 
 import numpy as np
 
+from encoding import EncodedSeq
+
 input = sys.stdin.readline
 
 
@@ -9,6 +13,132 @@ def normalize_rows(x):
     return x / x.sum(axis=1, keepdims=True)
 
 
+class Counts:
+    # transition and emission counts of (string, path) pairs; a pair can
+    # arrive in consecutive chunks, and the counts of chunks handled
+    # separately (other processes, other files) merge exactly, including
+    # the transition between the last state of one and the first of the
+    # next
+    def __init__(self, x_states, y_states):
+        self.x_states = x_states
+        self.y_states = y_states
+        k, m = len(x_states), len(y_states)
+        self.transition = np.zeros(m * m, dtype=np.int64)
+        self.emission = np.zeros(m * k, dtype=np.int64)
+        self.first = self.last = None  # states at the ends of the stream
+
+    def update(self, x, y, continued=False):
+        # counts of chunk x / y; continued chains it to the previous chunk
+        x = EncodedSeq.from_str(x, "".join(self.x_states)).codes
+        y = EncodedSeq.from_str(y, "".join(self.y_states)).codes
+        x, y = x.astype(np.intp), y.astype(np.intp)
+        assert len(x) == len(y)
+        if len(y) == 0:
+            return self
+        k, m = len(self.x_states), len(self.y_states)
+        self.emission += np.bincount(y * k + x, minlength=m * k)
+        self.transition += np.bincount(y[:-1] * m + y[1:], minlength=m * m)
+        if continued and self.last is not None:
+            self.transition[self.last * m + y[0]] += 1
+        if self.first is None:
+            self.first = y[0]
+        self.last = y[-1]
+        return self
+
+    def merge(self, other, continued=False):
+        # add the counts of other; continued if its stream goes on from
+        # where this one stops
+        assert self.x_states == other.x_states
+        assert self.y_states == other.y_states
+        self.emission += other.emission
+        self.transition += other.transition
+        if other.first is None:
+            return self
+        if continued and self.last is not None:
+            self.transition[self.last * len(self.y_states) + other.first] += 1
+        if self.first is None:
+            self.first = other.first
+        self.last = other.last
+        return self
+
+    def estimate(self):
+        # maximum likelihood probabilities; states never seen get a
+        # distribution putting everything on the first symbol
+        m = len(self.y_states)
+        transition = self.transition.reshape(m, m).astype(np.float64)
+        emission = self.emission.reshape(m, -1).astype(np.float64)
+        transition[transition.sum(1) == 0, 0] = 1
+        emission[emission.sum(1) == 0, 0] = 1
+        return normalize_rows(transition), normalize_rows(emission)
+
+
+def pair_counts(pair, x_states, y_states):
+    return Counts(x_states, y_states).update(*pair)
+
+
+def count_pairs(pairs, x_states, y_states, n_jobs=1):
+    # summed counts of independent (string, path) pairs, counted in a
+    # process pool when n_jobs > 1
+    total = Counts(x_states, y_states)
+    count = partial(pair_counts, x_states=x_states, y_states=y_states)
+    if n_jobs > 1:
+        with ProcessPoolExecutor(n_jobs) as pool:
+            for counts in pool.map(count, pairs):
+                total.merge(counts)
+    else:
+        for pair in pairs:
+            total.merge(count(pair))
+    return total
+
+
+def naive_counts(x, x_states, y, y_states):
+    # the per-symbol loops this module replaced, for the tests
+    transition = np.zeros((len(y_states), len(y_states)), dtype=np.int64)
+    emission = np.zeros((len(y_states), len(x_states)), dtype=np.int64)
+    for a, b in zip(x, y):
+        emission[y_states.index(b), x_states.index(a)] += 1
+    for a, b in zip(y, y[1:]):
+        transition[y_states.index(a), y_states.index(b)] += 1
+    return transition.ravel(), emission.ravel()
+
+
+def same_counts(a, b):
+    return (a.transition == b.transition).all() and (
+        a.emission == b.emission
+    ).all()
+
+
+def test():
+    rng = np.random.default_rng(0)
+    x_states, y_states = ["x", "y", "z"], ["A", "B", "C"]
+    pairs = []
+    for n in (1, 2, 10, 500):
+        x = "".join(rng.choice(x_states, n))
+        y = "".join(rng.choice(y_states[:2], n))
+        pairs.append((x, y))
+        whole = Counts(x_states, y_states).update(x, y)
+        transition, emission = naive_counts(x, x_states, y, y_states)
+        assert (whole.transition == transition).all()
+        assert (whole.emission == emission).all()
+
+        # chunks added in order or counted apart and merged
+        cuts = [0, *sorted(rng.integers(0, n, 3)), n]
+        chained = Counts(x_states, y_states)
+        merged = Counts(x_states, y_states)
+        for lo, hi in zip(cuts, cuts[1:]):
+            chained.update(x[lo:hi], y[lo:hi], continued=True)
+            part = Counts(x_states, y_states).update(x[lo:hi], y[lo:hi])
+            merged.merge(part, continued=True)
+        assert same_counts(chained, whole) and same_counts(merged, whole)
+
+    total = Counts(x_states, y_states)
+    for x, y in pairs:
+        total.update(x, y)
+    assert same_counts(count_pairs(pairs, x_states, y_states), total)
+    assert same_counts(count_pairs(pairs, x_states, y_states, 2), total)
+    print("counts test passed")
+
+
 def read():
     x = input().strip()
     input()
@@ -29,28 +159,13 @@ def round3(x):
 
 
 def main():
+    if sys.argv[1:] == ["--test"]:
+        test()
+        return
     x, x_states, y, y_states = read()
 
-    transition_matrix = np.zeros((len(y_states), len(y_states)))
-    emission_matrix = np.zeros((len(y_states), len(x_states)))
-
-    x_state_to_idx = dict((k, v) for v, k in enumerate(x_states))
-    y_state_to_idx = dict((k, v) for v, k in enumerate(y_states))
-
-    for a, b in zip(x, y):
-        i = x_state_to_idx[a]
-        j = y_state_to_idx[b]
-        emission_matrix[j, i] += 1
-
-    for i in range(len(y) - 1):
-        a = y_state_to_idx[y[i]]
-        b = y_state_to_idx[y[i + 1]]
-        transition_matrix[a, b] += 1
-
-    transition_matrix[transition_matrix.sum(1) == 0, 0] = 1
-    emission_matrix[emission_matrix.sum(1) == 0, 0] = 1
-    transition_matrix = normalize_rows(transition_matrix)
-    emission_matrix = normalize_rows(emission_matrix)
+    counts = Counts(x_states, y_states).update(x, y)
+    transition_matrix, emission_matrix = counts.estimate()
 
     print(" \t" + "\t".join(y_states))
     for s, row in zip(y_states, transition_matrix):
@@ -2,9 +2,10 @@ import sys
 from enum import Enum
 
 import numpy as np
-from frozendict import frozendict
 from numpy.core.numeric import Infinity
 
+from encoding import encode
+
 input = sys.stdin.readline
 
 
@@ -16,11 +17,6 @@ class Symbols(Enum):
     T = "T"
 
 
-class SymbolsMapping:
-    idx_to_char = tuple(c.value for c in Symbols)
-    char_to_idx = frozendict({k: i for i, k in enumerate(idx_to_char)})
-
-
 def window(s, k):
     n = len(s)
     for i in range(n - k + 1):
@@ -28,23 +24,15 @@ def window(s, k):
 
 
 def add_to_profile(s, profile):
-    for i, c in enumerate(s):
-        profile[i, SymbolsMapping.char_to_idx[c]] += 1
+    profile[np.arange(len(s)), s.codes] += 1
     return profile
 
 
 def profile_most_probable(s, k, profile):
-    best_prob = 0
-    best_motif = s[:k]
-
-    for motif in window(s, k):
-        prob = 1
-        for i, c in enumerate(motif):
-            prob *= profile[i, SymbolsMapping.char_to_idx[c]]
-        if prob > best_prob:
-            best_prob = prob
-            best_motif = motif
-    return best_motif
+    windows = np.lib.stride_tricks.sliding_window_view(s.codes, k)
+    probs = profile[np.arange(k), windows].prod(axis=1)
+    i = probs.argmax()
+    return s[i : i + k] if probs[i] > 0 else s[:k]
 
 
 def score(profile):
@@ -73,7 +61,7 @@ def main():
 
     dna = []
     for _ in range(n):
-        dna.append(input().strip())
+        dna.append(encode(input().strip()))
 
     motifs = greedy_motif_search(dna, k)
     print(*motifs, sep="\n")
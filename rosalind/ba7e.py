@@ -4,46 +4,238 @@ import numpy as np
 
 input = sys.stdin.readline
 
+_MAX_BLOCK = 256  # most sorted entries of a row scanned per step
+_SORT_ROWS = 1024  # rows sorted or scored at once
+_DENSE_RATIO = 4  # pruned searches reading size^2 / 4 entries stop paying
 
-def nanargmin2d(x):
-    n = x.shape[0]
-    idx = np.nanargmin(x)
-    i = idx // n
-    j = idx - i * n
-    assert i < j
-    return i, j
 
+def smallest_pair(a, b):
+    lo, hi = np.minimum(a, b), np.maximum(a, b)
+    k = np.lexsort((hi, lo))[0]
+    return int(lo[k]), int(hi[k])
 
-def main():
-    n = int(input())
-    dist = np.empty((2 * n - 2, 2 * n - 2))
-    dist.fill(np.nan)
 
-    for i in range(n):
-        dist[i, :n] = list(map(int, input().split()))
+class JoiningMatrix:
+    # active nodes are compacted into the first size slots of a dense
+    # distance matrix; every slot keeps its row sum and, as in RapidNJ,
+    # the node ids of its row sorted by distance at the time the node was
+    # created, so the pair search can stop early in every row
+    def __init__(self, dist):
+        n = len(dist)
+        self.size = n
+        self.dist = np.array(dist, dtype=np.float64)
+        self.dist[np.diag_indices(n)] = 0
+        self.sums = self.dist.sum(axis=1)
+        self.node = np.arange(n)  # node id in every slot
+        self.slot = np.full(2 * n, -1)  # slot of every node, -1 once joined
+        self.slot[:n] = np.arange(n)
+        self.order = np.empty((n, max(n - 1, 0)), dtype=np.int32)
+        self.length = np.zeros(n, dtype=np.intp)
+        self.head = np.zeros(n, dtype=np.intp)
+        self.dense = False
+        self.sort_rows(np.arange(n))
+
+    def sort_rows(self, slots):
+        # node ids of the other active slots by distance, a block at a time
+        size = self.size
+        for lo in range(0, len(slots), _SORT_ROWS):
+            rows = slots[lo : lo + _SORT_ROWS]
+            dist = self.dist[rows, :size].copy()
+            dist[np.arange(len(rows)), rows] = np.inf
+            order = np.argsort(dist, axis=1, kind="stable")[:, : size - 1]
+            self.order[rows, : size - 1] = self.node[order]
+        self.length[slots] = size - 1
+        self.head[slots] = 0
+
+    def closest_pair(self):
+        # (i, j) minimizing the Q criterion, the smallest pair on ties
+        if self.dense:
+            return self.closest_pair_dense()
+        size = self.size
+        denom = size - 2
+        sums = self.sums[:size]
+        max_sum = sums.max()
+        best, best_pair = np.inf, (-1, -1)
+        rows = np.arange(size)
+        pos = self.head[:size].copy()
+        scanned = 0
+        block = 1  # most rows stop at their first entry
+        while len(rows):
+            cols = pos[rows, None] + np.arange(block)
+            inside = cols < self.length[rows, None]
+            scanned += inside.sum()
+            nodes = self.order[rows[:, None], np.where(inside, cols, 0)]
+            slots = self.slot[nodes]
+            alive = inside & (slots >= 0)
+            d = self.dist[rows[:, None], np.maximum(slots, 0)]
+            partial = denom * d - sums[rows, None]
+            q = np.where(alive, partial - sums[np.maximum(slots, 0)], np.inf)
+
+            # skip entries that are joined for good at the start of a row
+            lead = np.where(alive.any(axis=1), alive.argmax(axis=1), block)
+            at_head = pos[rows] == self.head[rows]
+            self.head[rows[at_head]] += np.minimum(
+                lead[at_head], self.length[rows[at_head]] - pos[rows[at_head]]
+            )
+
+            q_min = q.min()
+            if q_min < np.inf and q_min <= best:
+                r, c = np.nonzero(q == q_min)
+                pair = smallest_pair(self.node[rows[r]], nodes[r, c])
+                if q_min < best or pair < best_pair:
+                    best, best_pair = q_min, pair
+
+            # later entries of a row are at least this far, so its search
+            # stops after an alive entry whose lower bound exceeds best
+            last = block - 1 - alive[:, ::-1].argmax(axis=1)
+            bound = partial[np.arange(len(rows)), last] - max_sum
+            done = (alive.any(axis=1) & (bound > best)) | ~inside[:, -1]
+            pos[rows] += block
+            block = min(4 * block, _MAX_BLOCK)
+            rows = rows[~done]
+
+        # once the bounds stop pruning, scoring every pair is cheaper
+        self.dense = scanned * _DENSE_RATIO > size * size
+        return best_pair
 
-    dist[np.diag_indices(n)] = np.nan
+    def closest_pair_dense(self):
+        size = self.size
+        denom = size - 2
+        sums = self.sums[:size]
+        node = self.node[:size]
+        best, best_pair = np.inf, (-1, -1)
+        for lo in range(0, size, _SORT_ROWS):
+            rows = slice(lo, min(lo + _SORT_ROWS, size))
+            q = denom * self.dist[rows, :size] - sums[rows, None] - sums
+            q[np.arange(len(q)), np.arange(lo, lo + len(q))] = np.inf
+            q_min = q.min()
+            if q_min > best:
+                continue
+            r, c = np.nonzero(q == q_min)
+            pair = smallest_pair(node[r + lo], node[c])
+            if q_min < best or pair < best_pair:
+                best, best_pair = q_min, pair
+        return best_pair
 
+    def join(self, i, j, m):
+        # replace nodes i and j by a new node m, returning the limb lengths
+        si, sj = self.slot[i], self.slot[j]
+        size = self.size
+        d = self.dist[si, sj]
+        delta = (self.sums[si] - self.sums[sj]) / (size - 2)
+        limbs = 0.5 * (d + delta), 0.5 * (d - delta)
+
+        new = 0.5 * (self.dist[:size, si] + self.dist[:size, sj] - d)
+        self.sums[:size] += new - self.dist[:size, si] - self.dist[:size, sj]
+        new[[si, sj]] = 0
+        self.dist[si, :size] = self.dist[:size, si] = new
+        self.sums[si] = new.sum()
+        self.slot[[i, j]] = -1
+        self.slot[m] = si
+        self.node[si] = m
+
+        # the last slot fills the hole left by j
+        last = size - 1
+        if sj != last:
+            self.dist[sj, :size] = self.dist[last, :size]
+            self.dist[:size, sj] = self.dist[:size, last]
+            self.dist[sj, sj] = 0
+            for name in ("sums", "node", "length", "head"):
+                getattr(self, name)[sj] = getattr(self, name)[last]
+            self.order[sj] = self.order[last]
+            self.slot[self.node[sj]] = sj
+        self.size = size = last
+        si = self.slot[m]
+
+        # rows mostly made of joined nodes are sorted again
+        stale = self.length[:size] - self.head[:size] > 2 * size
+        stale[si] = True
+        self.sort_rows(np.flatnonzero(stale))
+        return limbs
+
+
+def neighbor_joining(dist):
+    # edges (v, u, length) of the tree, new nodes numbered from n
+    n = len(dist)
+    if not np.isfinite(dist).all():
+        raise ValueError(
+            "neighbor joining needs finite distances, the matrix holds "
+            "nan or inf"
+        )
+    matrix = JoiningMatrix(dist)
+    ans = []
+    for m in range(n, 2 * n - 2):
+        i, j = matrix.closest_pair()
+        d_i, d_j = matrix.join(i, j, m)
+        ans.append((i, m, d_i))
+        ans.append((j, m, d_j))
+
+    i, j = sorted(matrix.node[:2])
+    ans.append((i, j, matrix.dist[matrix.slot[i], matrix.slot[j]]))
+    return ans
+
+
+def naive_neighbor_joining(dist):
+    # the O(n^3) algorithm this module replaced, for the tests: joined
+    # nodes are nan rows and columns of a (2n - 2) square matrix
+    n = len(dist)
+    d = np.full((2 * n - 2, 2 * n - 2), np.nan)
+    d[:n, :n] = dist
+    d[np.diag_indices(n)] = np.nan
     ans = []
     denom = n - 2
     for m in range(n, 2 * n - 2):
-        dist_q = (
-            denom * dist
-            - np.nansum(dist, axis=1, keepdims=True)
-            - np.nansum(dist, axis=0, keepdims=True)
-        )
-        i, j = nanargmin2d(dist_q)
-        delta = (np.nansum(dist[i]) - np.nansum(dist[j])) / denom
-        ans.append((i, m, 0.5 * (dist[i, j] + delta)))
-        ans.append((j, m, 0.5 * (dist[i, j] - delta)))
-        dist[m, ...] = dist[..., m] = 0.5 * (
-            dist[..., i] + dist[..., j] - dist[i, j]
-        )
+        sums = np.nansum(d, axis=1)
+        q = denom * d - sums[:, None] - sums[None, :]
+        i, j = np.unravel_index(np.nanargmin(q), q.shape)
+        delta = (sums[i] - sums[j]) / denom
+        ans.append((i, m, 0.5 * (d[i, j] + delta)))
+        ans.append((j, m, 0.5 * (d[i, j] - delta)))
+        d[m, :] = d[:, m] = 0.5 * (d[:, i] + d[:, j] - d[i, j])
         denom -= 1
-        dist[i, ...] = dist[..., i] = dist[j, ...] = dist[..., j] = np.nan
+        d[[i, j], :] = d[:, [i, j]] = np.nan
+    i, j = np.unravel_index(np.nanargmin(d), d.shape)
+    ans.append((i, j, d[i, j]))
+    return ans
+
 
-    i, j = nanargmin2d(dist)
-    ans.append((i, j, dist[i, j]))
+def same_edges(a, b):
+    a, b = sorted(a), sorted(b)
+    return [e[:2] for e in a] == [e[:2] for e in b] and np.allclose(
+        [e[2] for e in a], [e[2] for e in b]
+    )
+
+
+def test():
+    sample = [
+        [0, 23, 27, 20],
+        [23, 0, 30, 28],
+        [27, 30, 0, 30],
+        [20, 28, 30, 0],
+    ]
+    expected = [(0, 4, 8), (1, 5, 13.5), (2, 5, 16.5), (3, 4, 12), (4, 5, 2)]
+    assert same_edges(neighbor_joining(np.array(sample)), expected)
+
+    rng = np.random.default_rng(0)
+    for n in (3, 4, 5, 10, 60):
+        x = rng.integers(1, 100, (n, n)).astype(np.float64)
+        dist = x + x.T
+        dist[np.diag_indices(n)] = 0
+        assert same_edges(neighbor_joining(dist), naive_neighbor_joining(dist))
+    print("neighbor joining test passed")
+
+
+def main():
+    if sys.argv[1:] == ["--test"]:
+        test()
+        return
+    if len(sys.argv) > 1:  # a .npy matrix from distance_matrix.py
+        dist = np.load(sys.argv[1], mmap_mode="r")
+    else:
+        n = int(input())
+        dist = np.fromstring(sys.stdin.read(), dtype=np.float64, sep=" ")
+        dist = dist.reshape(n, n)
+    ans = neighbor_joining(dist)
 
     ans.sort()
     for v, u, w in ans:
@@ -0,0 +1,201 @@
+import argparse
+
+import numpy as np
+
+from ba7e import neighbor_joining
+from encoding import DNA, lookup_table
+from fasta import MappedFasta
+
+_MISSING = 4  # gaps, N and other ambiguity codes
+_CODES = lookup_table(DNA, _MISSING, ignore_case=True)
+
+_BLOCK = 1024  # rows and columns of a tile of the matrix
+_SITES = 1024  # alignment columns one-hot encoded at once
+
+MODELS = ("p", "jc", "k2p")
+MAX_DISTANCE = 10.0  # distance of saturated JC and K2P pairs
+
+
+def read_alignment(fname):
+    # names and the (sequences x sites) codes of an aligned FASTA, ACGT as
+    # 0..3 and anything else as missing
+    fasta = MappedFasta(fname)
+    names = [e.name for e in fasta.index]
+    lengths = {e.length for e in fasta.index}
+    assert len(lengths) <= 1, "sequences of an alignment differ in length"
+    codes = np.empty((len(names), max(lengths, default=0)), dtype=np.uint8)
+    for i in range(len(names)):
+        codes[i] = _CODES[fasta.sequence(i)]
+    return names, codes
+
+
+def one_hot(codes):
+    # symbols, purine / pyrimidine classes (A=0 and G=2 are even) and
+    # compared sites as float32 indicator matrices with sites flattened
+    valid = codes != _MISSING
+    symbols = np.eye(5, dtype=np.float32)[codes][..., :4]
+    classes = np.eye(3, dtype=np.float32)[np.where(valid, codes & 1, 2)]
+    return (
+        valid.astype(np.float32),
+        symbols.reshape(len(codes), -1),
+        classes[..., :2].reshape(len(codes), -1),
+    )
+
+
+def site_counts(a, b):
+    # compared sites (both ACGT), identical sites and sites of the same
+    # class for every pair of rows of a and b, each a matrix product
+    counts = np.zeros((3, len(a), len(b)))
+    for lo in range(0, a.shape[1], _SITES):
+        x = one_hot(a[:, lo : lo + _SITES])
+        y = one_hot(b[:, lo : lo + _SITES])
+        for k in range(3):
+            counts[k] += x[k] @ y[k].T
+    return counts
+
+
+def distances(counts, model, max_distance=MAX_DISTANCE):
+    # p-distance, Jukes-Cantor or Kimura two-parameter distances; pairs
+    # without compared sites are nan and saturated pairs are capped at
+    # max_distance, so neighbor joining can still place them
+    compared, same, same_class = counts
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if model == "k2p":
+            transitions = (same_class - same) / compared
+            transversions = (compared - same_class) / compared
+            res = -0.5 * np.log(
+                1 - 2 * transitions - transversions
+            ) - 0.25 * np.log(1 - 2 * transversions)
+        else:
+            res = (compared - same) / compared
+            if model == "jc":
+                res = -0.75 * np.log(1 - 4 / 3 * res)
+    res = np.where(np.isnan(res) & (compared > 0), np.inf, res)
+    return np.minimum(res, max_distance)
+
+
+def distance_matrix(codes, model="jc", out=None, max_distance=MAX_DISTANCE):
+    # all pairwise distances, one tile of the upper triangle at a time;
+    # with out the matrix is written to that .npy file, which np.load
+    # with mmap_mode can map without reading it
+    assert model in MODELS
+    n = len(codes)
+    if out is None:
+        res = np.zeros((n, n))
+    else:
+        res = np.lib.format.open_memmap(out, "w+", np.float64, (n, n))
+    for lo in range(0, n, _BLOCK):
+        rows = slice(lo, lo + _BLOCK)
+        for start in range(lo, n, _BLOCK):
+            cols = slice(start, start + _BLOCK)
+            counts = site_counts(codes[rows], codes[cols])
+            tile = distances(counts, model, max_distance)
+            res[rows, cols] = tile
+            res[cols, rows] = tile.T
+    res[np.diag_indices(n)] = 0
+    if out is not None:
+        res.flush()
+    return res
+
+
+def naive_distance(a, b, model):
+    # the distance of two code rows from their sites one at a time
+    compared = transitions = transversions = 0
+    for x, y in zip(a, b):
+        if x == _MISSING or y == _MISSING:
+            continue
+        compared += 1
+        if x != y and x % 2 == y % 2:
+            transitions += 1
+        elif x != y:
+            transversions += 1
+    if compared == 0:
+        return np.nan
+    p, q = transitions / compared, transversions / compared
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if model == "p":
+            res = p + q
+        elif model == "jc":
+            res = -0.75 * np.log(1 - 4 / 3 * (p + q))
+        else:
+            res = -0.5 * np.log(1 - 2 * p - q) - 0.25 * np.log(1 - 2 * q)
+    return min(MAX_DISTANCE, np.inf if np.isnan(res) else res)
+
+
+def test_reference():
+    rng = np.random.default_rng(1)
+    codes = rng.integers(0, 4, (8, 2500)).astype(np.uint8)
+    for i in range(1, len(codes)):  # from close to saturated rows
+        mutated = rng.random(codes.shape[1]) < i / 8
+        codes[i, mutated] = rng.integers(0, 4, mutated.sum())
+    codes[rng.random(codes.shape) < 0.1] = _MISSING
+    codes[-1, :] = _MISSING
+    for model in MODELS:
+        dist = distance_matrix(codes, model)
+        for i in range(len(codes)):
+            for j in range(i + 1, len(codes)):
+                expected = naive_distance(codes[i], codes[j], model)
+                assert np.allclose(dist[i, j], expected, equal_nan=True)
+                assert np.allclose(dist[j, i], expected, equal_nan=True)
+
+
+def test_neighbor_joining():
+    # unrelated rows are saturated under JC and K2P, yet every model
+    # gives a matrix neighbor joining turns into a tree
+    rng = np.random.default_rng(0)
+    codes = rng.integers(0, 4, (12, 60)).astype(np.uint8)
+    codes[6:] = codes[0]
+    codes[6:, ::5] = rng.integers(0, 4, (6, 12))
+    for model in MODELS:
+        dist = distance_matrix(codes, model)
+        assert np.isfinite(dist).all()
+        edges = neighbor_joining(dist)
+        assert len(edges) == 2 * len(codes) - 3
+        assert np.isfinite([w for _, _, w in edges]).all()
+
+    codes[3] = _MISSING  # no compared sites, rejected
+    try:
+        neighbor_joining(distance_matrix(codes))
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("a nan distance was accepted")
+
+
+def test():
+    test_reference()
+    print("distance reference test passed")
+    test_neighbor_joining()
+    print("neighbor joining test passed")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="pairwise evolutionary distances of an aligned FASTA"
+    )
+    parser.add_argument("fasta", nargs="?")
+    parser.add_argument(
+        "out", nargs="?", help=".npy file for the distance matrix"
+    )
+    parser.add_argument("--model", choices=MODELS, default="jc")
+    parser.add_argument(
+        "--max-distance",
+        type=float,
+        default=MAX_DISTANCE,
+        help="distance of saturated pairs",
+    )
+    parser.add_argument("--test", action="store_true", help="self-check")
+    args = parser.parse_args()
+    if args.test:
+        test()
+        return
+    if args.out is None:
+        parser.error("fasta and out are required")
+
+    names, codes = read_alignment(args.fasta)
+    distance_matrix(codes, args.model, args.out, args.max_distance)
+    print(f"{len(names)} sequences, {codes.shape[1]} sites -> {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+# every folder runs on its own, so 1_2, 1_3, 1_5 and rosalind keep
+# identical copies of this module; change them together
+import numpy as np
+
+DNA = "ACGT"
+
+
+def lookup_table(alphabet, missing=255, ignore_case=False):
+    # code of every byte value, missing for bytes out of the alphabet
+    lut = np.full(256, missing, dtype=np.uint8)
+    for i, c in enumerate(alphabet):
+        lut[ord(c)] = i
+        if ignore_case:
+            lut[ord(c.lower())] = lut[ord(c.upper())] = i
+    return lut
+
+
+def as_bytes(s):  # ASCII uint8 arrays (MappedFasta) are used as they are
+    if isinstance(s, np.ndarray):
+        return s
+    return np.frombuffer(str(s).encode(), dtype=np.uint8)
+
+
+class EncodedSeq:  # uint8 indices into an alphabet string
+    def __init__(self, codes, alphabet):
+        self.codes = codes
+        self.alphabet = alphabet
+
+    @classmethod
+    def from_str(cls, s, alphabet=DNA):
+        codes = lookup_table(alphabet)[as_bytes(s)]
+        assert (codes != 255).all(), f"symbol out of alphabet {alphabet}"
+        return cls(codes, alphabet)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return EncodedSeq(self.codes[key], self.alphabet)
+        return self.alphabet[self.codes[key]]
+
+    def __iter__(self):
+        return (self.alphabet[c] for c in self.codes)
+
+    def __str__(self):
+        symbols = np.frombuffer(self.alphabet.encode(), dtype=np.uint8)
+        return symbols[self.codes].tobytes().decode()
+
+    def __repr__(self):
+        return f"EncodedSeq({str(self)!r}, {self.alphabet!r})"
+
+
+def encode(s, alphabet=DNA):
+    if isinstance(s, EncodedSeq) and s.alphabet == alphabet:
+        return s
+    return EncodedSeq.from_str(s, alphabet)
+
+
+def encode_all(seqs):
+    # seqs as EncodedSeq over one alphabet, the one they are already
+    # encoded over or else the sorted symbols of all of them, so any
+    # characters can be compared; returns (encoded seqs, alphabet)
+    seqs = list(seqs)
+    alphabets = {getattr(s, "alphabet", None) for s in seqs}
+    if len(alphabets) == 1 and all(isinstance(s, EncodedSeq) for s in seqs):
+        return seqs, alphabets.pop()
+    alphabet = "".join(sorted(set().union(*map(str, seqs))))
+    return [encode(s, alphabet) for s in seqs], alphabet
+
+
+def match_matrix(alphabet, match_cost, mismatch_cost):
+    dtype = np.result_type(match_cost, mismatch_cost)
+    scores = np.full(
+        (len(alphabet), len(alphabet)), mismatch_cost, dtype=dtype
+    )
+    np.fill_diagonal(scores, match_cost)
+    return scores
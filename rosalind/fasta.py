@@ -0,0 +1,205 @@
+# every folder runs on its own, so 1_1, 1_4 and rosalind keep identical
+# copies of this module; change them together
+import mmap
+import os
+import tempfile
+from collections import namedtuple
+
+import numpy as np
+
+_NEWLINE = ord("\n")
+_CR = ord("\r")
+_HEADER = ord(">")
+
+# one line of a samtools .fai index
+FaiEntry = namedtuple(
+    "FaiEntry", ["name", "length", "offset", "line_bases", "line_width"]
+)
+
+
+class MappedFasta:
+    # memory-mapped FASTA file with a .fai-like offset index; sequences
+    # are uint8 views into the mapping, so nothing is parsed into strings
+    def __init__(self, fname):
+        self.fname = fname
+        with open(fname, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                self.data = np.zeros(0, dtype=np.uint8)
+            else:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self.data = np.frombuffer(self._mmap, dtype=np.uint8)
+        self.index = self.read_index()
+        self.names = {e.name: i for i, e in enumerate(self.index)}
+
+    @property
+    def fai_name(self):
+        return self.fname + ".fai"
+
+    def read_index(self):
+        # the saved index unless it is older than the FASTA or has records
+        # running past its end, then the FASTA changed and it is rebuilt
+        if os.path.exists(self.fai_name) and os.path.getmtime(
+            self.fai_name
+        ) >= os.path.getmtime(self.fname):
+            index = read_fai(self.fai_name)
+            if all(record_end(e) <= len(self.data) for e in index):
+                return index
+        return build_index(self.data)
+
+    def save_index(self):
+        with open(self.fai_name, "w") as f:
+            for e in self.index:
+                print(*e, sep="\t", file=f)
+
+    def __len__(self):
+        return len(self.index)
+
+    def entry(self, key):
+        return self.index[self.names[key] if isinstance(key, str) else key]
+
+    def lines(self, key):
+        # zero-copy (full lines x line_bases) view and the last short line
+        e = self.entry(key)
+        n_full = e.length // e.line_bases if e.line_bases else 0
+        full = np.lib.stride_tricks.as_strided(
+            self.data[e.offset :],
+            shape=(n_full, e.line_bases),
+            strides=(e.line_width, 1),
+            writeable=False,
+        )
+        start = e.offset + n_full * e.line_width
+        return (
+            full,
+            self.data[start : start + e.length - n_full * e.line_bases],
+        )
+
+    def sequence(self, key):
+        # zero-copy for single-line records, one copy otherwise
+        e = self.entry(key)
+        if e.length <= e.line_bases:
+            return self.data[e.offset : e.offset + e.length]
+        full, tail = self.lines(key)
+        return np.concatenate([full.reshape(-1), tail])
+
+    def string(self, key):
+        return self.sequence(key).tobytes().decode()
+
+    def chunks(self, key, size, overlap=0):
+        # consecutive windows of size bases (the last may be shorter) where
+        # each window repeats the last overlap bases of the previous one
+        assert 0 <= overlap < size
+        e = self.entry(key)
+        for start in range(0, max(e.length - overlap, 1), size - overlap):
+            yield self.slice(key, start, min(start + size, e.length))
+
+    def slice(self, key, start, stop):
+        # bases [start, stop) of a record, a view when they fit in a line
+        e = self.entry(key)
+        if stop <= start:
+            return self.data[:0]
+        first, last = start // e.line_bases, (stop - 1) // e.line_bases
+        skip = start - first * e.line_bases
+        if first == last:
+            offset = e.offset + first * e.line_width + skip
+            return self.data[offset : offset + stop - start]
+        full, tail = self.lines(key)
+        if last < len(full):
+            rows = full[first : last + 1].reshape(-1)
+        else:
+            rows = np.concatenate([full[first:].reshape(-1), tail])
+        return rows[skip : skip + stop - start]
+
+    def __iter__(self):  # (name, sequence) for every record
+        for i, e in enumerate(self.index):
+            yield e.name, self.sequence(i)
+
+
+def build_index(data):
+    if len(data) == 0:
+        return []
+    newlines = np.flatnonzero(data == _NEWLINE)
+    if data[-1] != _NEWLINE:
+        newlines = np.append(newlines, len(data))
+    starts = np.concatenate([[0], newlines[:-1] + 1])
+    ends = newlines - (data[np.maximum(newlines - 1, 0)] == _CR)
+    ends = np.maximum(ends, starts)
+    first = data[np.minimum(starts, len(data) - 1)]
+    headers = np.flatnonzero((first == _HEADER) & (starts < ends))
+    bounds = np.append(headers, len(starts))
+
+    index = []
+    for h, next_h in zip(bounds[:-1], bounds[1:]):
+        header = data[starts[h] + 1 : ends[h]].tobytes().decode()
+        name = (header.split() or [""])[0]
+        lengths = np.trim_zeros(
+            ends[h + 1 : next_h] - starts[h + 1 : next_h], "b"
+        )
+        if len(lengths) == 0:
+            index.append(FaiEntry(name, 0, int(newlines[h] + 1), 0, 0))
+            continue
+        line_bases = int(lengths[0])
+        line_width = int(newlines[h + 1] + 1 - starts[h + 1])
+        if (lengths[:-1] != line_bases).any() or lengths[-1] > line_bases:
+            raise ValueError(f"{name}: lines of different length")
+        index.append(
+            FaiEntry(
+                name,
+                int(lengths.sum()),
+                int(starts[h + 1]),
+                line_bases,
+                line_width,
+            )
+        )
+    return index
+
+
+def record_end(e):  # offset just past the last base of a record
+    if e.line_bases == 0:
+        return e.offset
+    full, rest = divmod(e.length, e.line_bases)
+    return e.offset + full * e.line_width + rest
+
+
+def read_fai(fname):
+    index = []
+    with open(fname) as f:
+        for line in f:
+            name, *values = line.split("\t")
+            index.append(FaiEntry(name, *map(int, values[:4])))
+    return index
+
+
+def test_index(tmp):
+    fname = os.path.join(tmp, "test.fasta")
+    with open(fname, "w") as f:
+        f.write(">a first\nACGTA\nCG\n>b\n\n>c\nTTTT\nTTTT\nT\n")
+    fasta = MappedFasta(fname)
+    assert [fasta.string(i) for i in range(3)] == ["ACGTACG", "", "TTTTTTTTT"]
+    assert fasta.string("c")[2:7] == fasta.slice("c", 2, 7).tobytes().decode()
+    fasta.save_index()
+
+    # an index saved after the FASTA is reused
+    with open(fasta.fai_name, "a") as f:
+        f.write("d\t1\t0\t1\t2\n")
+    assert len(MappedFasta(fname)) == 4
+
+    # an index older than the FASTA is rebuilt
+    with open(fname, "w") as f:
+        f.write(">x\nGGGGGG\nCC\n")
+    stamp = os.path.getmtime(fname)
+    os.utime(fasta.fai_name, (stamp - 10, stamp - 10))
+    assert [e.name for e in MappedFasta(fname).index] == ["x"]
+
+    # so is a newer one whose records do not fit in the file
+    os.utime(fasta.fai_name, (stamp + 10, stamp + 10))
+    assert MappedFasta(fname).string(0) == "GGGGGGCC"
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        test_index(tmp)
+    print("fasta index test passed")
+
+
+if __name__ == "__main__":
+    main()
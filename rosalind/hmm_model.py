@@ -0,0 +1,231 @@
+import argparse
+import math
+import os
+import tempfile
+
+import numpy as np
+
+from encoding import EncodedSeq
+
+_SEPARATOR = "--------"
+_FIELDS = ("log_start", "log_transition", "log_emission")
+
+
+def read_sections(text):
+    # non-empty lines of every section between the dashed separators
+    sections = [[]]
+    for line in text.splitlines():
+        if line.startswith(_SEPARATOR):
+            sections.append([])
+        elif line.strip():
+            sections[-1].append(line)
+    return sections
+
+
+def parse_matrix(lines, rows, cols):
+    # a labelled probability table as a dense (rows x cols) array
+    header = lines[0].split()
+    col_idx = [header.index(c) for c in cols]
+    res = np.zeros((len(rows), len(cols)))
+    found = {}
+    for line in lines[1:]:
+        label, *values = line.split()
+        found[label] = np.array(values, dtype=np.float64)[col_idx]
+    for i, r in enumerate(rows):
+        res[i] = found[r]
+    return res
+
+
+def safe_log(x):
+    with np.errstate(divide="ignore"):
+        return np.log(np.asarray(x, dtype=np.float64))
+
+
+def format_prob(log_p):
+    # a probability given by its log to 12 significant digits, in
+    # scientific notation below the smallest float instead of 0
+    if log_p > -700 or log_p == -np.inf:
+        return f"{math.exp(log_p):.12g}"
+    exponent = math.floor(log_p / math.log(10))
+    mantissa = math.exp(log_p - exponent * math.log(10))
+    return f"{mantissa:.12g}e{exponent}"
+
+
+def parse_args(description):
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument(
+        "--model", help=".npz model used instead of the tables on stdin"
+    )
+    parser.add_argument("--save-model", help=".npz file for the model")
+    return parser.parse_args()
+
+
+def get_model(args, states, symbols, build, tables):
+    # the model of --model, or else build() parsing the tables; saved to
+    # --save-model. A loaded model must have the states of the input, the
+    # tables (_FIELDS names) the script uses and, when symbols is not None,
+    # the symbols of the input, so a model saved by any of ba10a, ba10b
+    # and ba10c serves every script it holds the tables for
+    if args.model is not None:
+        model = HMMModel.load(args.model)
+        missing = [name for name in tables if getattr(model, name) is None]
+        if model.states != list(states):
+            raise ValueError(
+                f"{args.model} has states {model.states}, the input "
+                f"{list(states)}"
+            )
+        if missing:
+            raise ValueError(
+                f"{args.model} has no {' or '.join(missing)} table"
+            )
+        if symbols is not None and model.symbols != list(symbols):
+            raise ValueError(
+                f"{args.model} has symbols {model.symbols}, the input "
+                f"{list(symbols)}"
+            )
+    else:
+        model = build()
+    if args.save_model is not None:
+        model.save(args.save_model)
+    return model
+
+
+class HMMModel:
+    # states and symbols (single characters) with their index maps and
+    # dense log-probabilities: start (m), transition (m x m) and emission
+    # (m x k); a problem may leave the transitions or emissions out
+    def __init__(
+        self,
+        states,
+        symbols=(),
+        log_transition=None,
+        log_emission=None,
+        log_start=None,
+    ):
+        self.states = list(states)
+        self.symbols = list(symbols)
+        self.state_index = {s: i for i, s in enumerate(self.states)}
+        self.symbol_index = {s: i for i, s in enumerate(self.symbols)}
+        m = len(self.states)
+        if log_start is None:
+            log_start = np.full(m, -np.log(m))
+        self.log_start = np.asarray(log_start, dtype=np.float64)
+        self.log_transition = log_transition
+        self.log_emission = log_emission
+
+    @classmethod
+    def from_sections(cls, states, symbols=(), transition=None, emission=None):
+        # transition and emission are the lines of their Rosalind tables
+        if transition is not None:
+            transition = safe_log(parse_matrix(transition, states, states))
+        if emission is not None:
+            emission = safe_log(parse_matrix(emission, states, symbols))
+        return cls(states, symbols, transition, emission)
+
+    def save(self, fname):
+        arrays = {
+            name: getattr(self, name)
+            for name in _FIELDS
+            if getattr(self, name) is not None
+        }
+        with open(fname, "wb") as f:
+            np.savez(
+                f,
+                states=np.array(self.states, dtype=str),
+                symbols=np.array(self.symbols, dtype=str),
+                **arrays,
+            )
+
+    @classmethod
+    def load(cls, fname):
+        with np.load(fname) as data:
+            return cls(
+                data["states"].tolist(),
+                data["symbols"].tolist(),
+                data["log_transition"] if "log_transition" in data else None,
+                data["log_emission"] if "log_emission" in data else None,
+                data["log_start"],
+            )
+
+    def encode_states(self, path):
+        return EncodedSeq.from_str(path, "".join(self.states)).codes
+
+    def encode_symbols(self, x):
+        return EncodedSeq.from_str(x, "".join(self.symbols)).codes
+
+    def path_log_prob(self, path):
+        # log P(path), one gather over consecutive state pairs
+        p = self.encode_states(path).astype(np.intp)
+        if len(p) == 0:
+            return 0.0
+        steps = self.log_transition[p[:-1], p[1:]]
+        return float(self.log_start[p[0]] + steps.sum())
+
+    def emission_log_prob(self, x, path):
+        # log P(x | path), one gather over (state, symbol) pairs
+        p = self.encode_states(path)
+        codes = self.encode_symbols(x)
+        assert len(p) == len(codes)
+        return float(self.log_emission[p, codes].sum())
+
+
+def test_round_trip(fname):
+    text = """--------
+\tA\tB
+A\t0.9\t0.1
+B\t0.0\t1.0
+--------
+\tx\ty\tz
+B\t0.5\t0.25\t0.25
+A\t0.2\t0.3\t0.5
+"""
+    transition, emission = read_sections(text)[1:]
+    model = HMMModel.from_sections("AB", "xyz", transition, emission)
+    assert np.allclose(np.exp(model.log_emission[1]), [0.5, 0.25, 0.25])
+    model.save(fname)
+    loaded = HMMModel.load(fname)
+    assert loaded.states == model.states and loaded.symbols == model.symbols
+    for name in _FIELDS:
+        assert np.array_equal(getattr(loaded, name), getattr(model, name))
+
+    # probabilities are plain products, minus infinity when impossible
+    p = 0.5 * 0.9 * 0.9 * 0.1
+    assert np.isclose(model.path_log_prob("AAAB"), np.log(p))
+    assert model.path_log_prob("BA") == -np.inf
+    p = 0.2 * 0.3 * 0.25
+    assert np.isclose(model.emission_log_prob("xyy", "AAB"), np.log(p))
+    assert format_prob(np.log(0.3) * 2000) == "1.74787125172e-1046"
+
+    # a saved model is only used for the states and symbols it was made
+    # for, and only by scripts whose tables it holds
+    def refused(*args):
+        try:
+            get_model(*args)
+        except ValueError:
+            return True
+        return False
+
+    full = argparse.Namespace(model=fname, save_model=None)
+    transition = ("log_transition",)
+    both = ("log_transition", "log_emission")
+    assert get_model(full, "AB", "xyz", None, both).states == ["A", "B"]
+    assert get_model(full, "AB", None, None, transition).symbols == list("xyz")
+    assert refused(full, "AB", "xy", None, both)
+    assert refused(full, "BA", None, None, transition)
+
+    # a model of emissions only, as ba10b saves it, is no use to Viterbi
+    partial = HMMModel.from_sections("AB", "xyz", emission=emission)
+    partial.save(fname)
+    assert get_model(full, "AB", "xyz", None, ("log_emission",)) is not None
+    assert refused(full, "AB", "xyz", None, both)
+    assert refused(full, "AB", None, None, transition)
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        test_round_trip(os.path.join(tmp, "model.npz"))
+    print("model round trip test passed")
+
+
+if __name__ == "__main__":
+    main()